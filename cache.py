@@ -0,0 +1,96 @@
+# cache.py
+"""
+프로세스 내 LRU 캐시 (스레드 안전)
+
+캐시마다 이름을 붙여 등록해 두면 all_cache_stats() 로
+적중/미스/축출 횟수를 한 번에 모니터링할 수 있다.
+"""
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class LRUCache:
+    def __init__(self, name, maxsize):
+        if maxsize <= 0:
+            raise ValueError("maxsize 는 1 이상이어야 합니다")
+        self.name = name
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with _registry_lock:
+            _registry[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get_or_compute(self, key, compute):
+        """캐시에 없으면 compute() 결과를 저장 후 반환 (계산은 락 밖에서)"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_MISSING = object()
+
+
+def all_cache_stats():
+    with _registry_lock:
+        caches = list(_registry.values())
+    return {c.name: c.stats() for c in caches}
+
+
+def freeze(obj):
+    """dict/list 를 읽기 전용 구조(MappingProxyType/tuple)로 재귀 변환"""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    return obj
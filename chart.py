@@ -0,0 +1,151 @@
+# chart.py
+"""
+정수 코드 기반 사주 명식(Chart)
+
+네 기둥을 60갑자 코드(0~59) 네 개로 들고 다닌다.
+천간 = 코드 % 10, 지지 = 코드 % 12.
+해시·비교가 가능하고 4바이트로 직렬화되므로 모든 캐시의 키로 쓴다.
+템플릿용 문자열 dict 는 to_pillars() 로 만든다.
+"""
+from functools import total_ordering
+
+from pillar_table import GANZHI, GANZHI_CODE
+
+PILLAR_NAMES = ("year", "month", "day", "hour")
+
+# 월간은 연간으로, 시간은 일간으로 정해지므로 유효한 명식은 60 x 12 x 60 x 12 가지
+VALID_CHART_COUNT = 60 * 12 * 60 * 12
+
+
+def _code(stem, branch):
+    return (6 * stem - 5 * branch) % 60
+
+
+def month_code(year_stem, month_branch):
+    """연간 + 월지 → 월주 코드 (寅월 기준 五虎遁)"""
+    return _code((year_stem % 5 * 2 + 2 + (month_branch - 2) % 12) % 10, month_branch)
+
+
+def hour_code(day_stem, hour_branch):
+    """일간 + 시지 → 시주 코드 (五鼠遁)"""
+    return _code((day_stem % 5 * 2 + hour_branch) % 10, hour_branch)
+
+
+@total_ordering
+class Chart:
+    __slots__ = ("codes", "_hash")
+
+    def __init__(self, year, month, day, hour):
+        codes = (year, month, day, hour)
+        for c in codes:
+            if not (isinstance(c, int) and 0 <= c < 60):
+                raise ValueError(f"잘못된 60갑자 코드: {codes}")
+        object.__setattr__(self, "codes", codes)
+        object.__setattr__(self, "_hash", hash(codes))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Chart 는 변경할 수 없습니다")
+
+    # --- 생성 ---
+    @classmethod
+    def from_codes(cls, codes):
+        return cls(*(int(c) for c in codes))
+
+    @classmethod
+    def from_pillars(cls, pillars):
+        """{'year': '甲子', ...} 또는 간지 문자열 4개 → Chart"""
+        if isinstance(pillars, dict):
+            pillars = [pillars[name] for name in PILLAR_NAMES]
+        try:
+            return cls(*(GANZHI_CODE[p] for p in pillars))
+        except KeyError as e:
+            raise ValueError(f"잘못된 간지: {e.args[0]}") from None
+
+    @classmethod
+    def from_bytes(cls, raw):
+        if len(raw) != 4:
+            raise ValueError("Chart 바이트 길이는 4 이어야 합니다")
+        return cls(*raw)
+
+    @classmethod
+    def from_key(cls, key):
+        hour = key % 60
+        key //= 60
+        day = key % 60
+        key //= 60
+        return cls(key // 60, key % 60, day, hour)
+
+    # --- 직렬화 / 키 ---
+    def to_bytes(self):
+        return bytes(self.codes)
+
+    @property
+    def key(self):
+        """0 ~ 60**4-1 범위의 정수 키"""
+        y, m, d, h = self.codes
+        return ((y * 60 + m) * 60 + d) * 60 + h
+
+    def to_pillars(self):
+        return {name: GANZHI[c] for name, c in zip(PILLAR_NAMES, self.codes)}
+
+    # --- 천간 / 지지 인덱스 ---
+    @property
+    def stems(self):
+        return tuple(c % 10 for c in self.codes)
+
+    @property
+    def branches(self):
+        return tuple(c % 12 for c in self.codes)
+
+    @property
+    def day_stem(self):
+        return self.codes[2] % 10
+
+    @property
+    def day_branch(self):
+        return self.codes[2] % 12
+
+    # --- 비교 / 해시 ---
+    def __eq__(self, other):
+        if not isinstance(other, Chart):
+            return NotImplemented
+        return self.codes == other.codes
+
+    def __lt__(self, other):
+        if not isinstance(other, Chart):
+            return NotImplemented
+        return self.codes < other.codes
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (Chart, self.codes)
+
+    def __repr__(self):
+        return f"Chart({' '.join(GANZHI[c] for c in self.codes)})"
+
+
+def valid_index(chart):
+    """
+    유효 명식의 0 ~ VALID_CHART_COUNT-1 순번, 규칙에 맞지 않으면 None
+    (예: 23시 야자시는 다음 날 천간을 쓰므로 범위 밖일 수 있다)
+    """
+    y, m, d, h = chart.codes
+    mb, hb = m % 12, h % 12
+    if month_code(y % 10, mb) != m or hour_code(d % 10, hb) != h:
+        return None
+    return ((y * 12 + mb) * 60 + d) * 12 + hb
+
+
+def chart_from_valid_index(index):
+    index, hb = divmod(index, 12)
+    index, d = divmod(index, 60)
+    y, mb = divmod(index, 12)
+    return Chart(y, month_code(y % 10, mb), d, hour_code(d % 10, hb))
+
+
+def iter_valid_charts():
+    """valid_index 순서대로 모든 유효 명식"""
+    for i in range(VALID_CHART_COUNT):
+        yield chart_from_valid_index(i)
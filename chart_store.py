@@ -0,0 +1,170 @@
+# chart_store.py
+"""
+유효 명식 전체(518,400개)의 사전 계산 결과 저장소
+
+get_saju_details 결과, SajuAnalyzer 오행 카운트·요약문, 일주 키를
+명식 순번(chart.valid_index) 위치에 고정 길이 레코드로 저장한다.
+문자열은 파일 끝의 어휘 목록(JSON)에 한 번만 두고 레코드에는 인덱스만 둔다.
+워커는 파일을 mmap 으로 열어 레코드 하나를 바로 읽는다.
+
+헤더의 rules digest 가 현재 코드의 표와 다르면 로드하지 않는다 (다시 빌드 필요).
+
+빌드: python chart_store.py [출력 경로]
+"""
+import json
+import mmap
+import os
+import struct
+from datetime import datetime
+
+from chart import (PILLAR_NAMES, VALID_CHART_COUNT, chart_from_valid_index,
+                   valid_index)
+from pillar_table import GANZHI
+
+STORE_PATH = os.getenv("CHART_STORE_PATH", "chart_store.bin")
+STORE_MAGIC = b"SZCS"
+STORE_VERSION = 1
+# magic, version, record size, 레코드 수, rules digest, 어휘 offset, 어휘 길이
+STORE_HEADER = struct.Struct("<4sHHI32sQI")
+
+# 기둥별로 저장하는 문자열 필드 (gan/zhi 는 60갑자 코드에서 복원)
+PILLAR_FIELDS = ("element_gan", "yin_gan", "element_zhi", "yin_zhi",
+                 "ten_god", "ten_god_zhi", "twelve_stage", "twelve_god")
+ELEMENTS = ("목", "화", "토", "금", "수")
+# 기둥 4 x 필드 8 (u8 어휘 인덱스), 오행 카운트 5 (u8), 요약문 (u16), 일주 코드 (u8)
+RECORD = struct.Struct("<32B5BHB")
+
+
+class ChartStore:
+    """mmap 으로 연 읽기 전용 명식 저장소"""
+
+    def __init__(self, path, expected_digest=None):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, record_size, count, digest,
+             vocab_offset, vocab_len) = STORE_HEADER.unpack_from(self._mm, 0)
+            if magic != STORE_MAGIC or version != STORE_VERSION or record_size != RECORD.size:
+                raise ValueError(f"잘못된 명식 저장소 파일: {path}")
+            if count != VALID_CHART_COUNT:
+                raise ValueError(f"명식 저장소 레코드 수가 다릅니다: {count}")
+            if expected_digest is not None and digest != expected_digest:
+                raise ValueError("명식 저장소가 현재 사주 표와 다릅니다 (다시 빌드하세요)")
+            vocab = json.loads(self._mm[vocab_offset:vocab_offset + vocab_len].decode("utf-8"))
+        except Exception:
+            self._mm.close()
+            raise
+        self.path = path
+        self.digest = digest
+        self.built = vocab["built"]
+        self._labels = vocab["labels"]
+        self._summaries = vocab["summaries"]
+
+    def get_raw(self, index):
+        """순번 → 레코드 튜플 (디코딩 전)"""
+        return RECORD.unpack_from(self._mm, STORE_HEADER.size + index * RECORD.size)
+
+    def get(self, chart):
+        """
+        Chart → {'details', 'element_counts', 'summary', 'ilju'}
+        유효 명식이 아니면 None
+        """
+        index = valid_index(chart)
+        if index is None:
+            return None
+        raw = self.get_raw(index)
+        labels = self._labels
+        details = {}
+        for p, (name, code) in enumerate(zip(PILLAR_NAMES, chart.codes)):
+            base = p * len(PILLAR_FIELDS)
+            info = {"gan": GANZHI[code][0], "zhi": GANZHI[code][1]}
+            for f, field in enumerate(PILLAR_FIELDS):
+                info[field] = labels[raw[base + f]]
+            details[name] = info
+        return {
+            "details": details,
+            "element_counts": dict(zip(ELEMENTS, raw[32:37])),
+            "summary": self._summaries[raw[37]],
+            "ilju": GANZHI[raw[38]],
+        }
+
+    def as_array(self):
+        """분석용 numpy 구조 배열 뷰 (복사 없음, valid_index 순서)"""
+        import numpy as np
+        dtype = np.dtype([("pillars", "u1", (4, len(PILLAR_FIELDS))),
+                          ("element_counts", "u1", (len(ELEMENTS),)),
+                          ("summary", "<u2"), ("ilju", "u1")])
+        return np.frombuffer(self._mm, dtype=dtype, count=VALID_CHART_COUNT,
+                             offset=STORE_HEADER.size)
+
+    def label(self, index):
+        return self._labels[index]
+
+    def summary(self, index):
+        return self._summaries[index]
+
+
+def load_store(path=STORE_PATH, expected_digest=None):
+    """저장소를 열어 반환, 없거나 맞지 않으면 None (요청 시 직접 계산)"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return ChartStore(path, expected_digest)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"⚠️ 명식 저장소 로드 실패, 직접 계산 사용: {e}")
+        return None
+
+
+def build_store(path, details_fn, counts_fn, summary_fn, digest):
+    """
+    모든 유효 명식에 대해 계산 함수를 돌려 저장소 파일 생성
+    details_fn(chart) → get_saju_details 형식 dict
+    counts_fn(chart) → 오행 카운트 dict, summary_fn(chart) → 요약문
+    """
+    labels, label_idx = [], {}
+    summaries, summary_idx = [], {}
+
+    def intern(value, table, index, limit):
+        i = index.get(value)
+        if i is None:
+            i = index[value] = len(table)
+            if i >= limit:
+                raise RuntimeError("어휘가 레코드 필드 크기를 넘었습니다")
+            table.append(value)
+        return i
+
+    body = bytearray(VALID_CHART_COUNT * RECORD.size)
+    for i in range(VALID_CHART_COUNT):
+        chart = chart_from_valid_index(i)
+        details = details_fn(chart)
+        fields = [intern(details[name][field], labels, label_idx, 256)
+                  for name in PILLAR_NAMES for field in PILLAR_FIELDS]
+        counts = counts_fn(chart)
+        RECORD.pack_into(body, i * RECORD.size, *fields,
+                         *(counts[el] for el in ELEMENTS),
+                         intern(summary_fn(chart), summaries, summary_idx, 1 << 16),
+                         chart.codes[2])
+
+    vocab = json.dumps({"labels": labels, "summaries": summaries,
+                        "built": datetime.now().isoformat(timespec="seconds")},
+                       ensure_ascii=False).encode("utf-8")
+    vocab_offset = STORE_HEADER.size + len(body)
+    header = STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, RECORD.size, VALID_CHART_COUNT,
+                               digest, vocab_offset, len(vocab))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(body)
+        f.write(vocab)
+    os.replace(tmp_path, path)
+    return VALID_CHART_COUNT
+
+
+if __name__ == "__main__":
+    import sys
+    from main import _compute_saju_details, _saju_analyzer, saju_rules_digest
+
+    out = sys.argv[1] if len(sys.argv) > 1 else STORE_PATH
+    n = build_store(out, _compute_saju_details, _saju_analyzer.element_counts,
+                    _saju_analyzer.analyze_chart, saju_rules_digest())
+    print(f"명식 저장소 저장 완료: {out} ({n}개)")
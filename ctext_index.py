@@ -0,0 +1,221 @@
+# ctext_index.py
+"""
+三命通会 원문(ctext.db wiki_content) FTS5 전문 검색 색인
+
+검색어가 대부분 1~2글자(甲子, 丙寅, 財)라 글자 단위로 색인한다.
+색인 열에는 글자 사이에 공백을 넣은 텍스트(fts_chars)를 넣고 unicode61 로 토큰화하며,
+검색어는 글자들의 구(phrase)로 찾는다 → 길이와 관계없이 색인 검색 + bm25 순위.
+unicode61 은 문장부호·공백을 버리므로 fts_chars 가 이를 문자마다 다른 토큰
+(사용자 영역 문자 FTS_GAP + 코드포인트)으로 바꿔 둔다 → 문장부호를 건너뛰어 붙는 일 없이
+부분 문자열(LIKE)과 같은 결과 (대소문자는 LIKE 와 달리 ASCII 밖에서도 구분하지 않음).
+트리거가 INSERT/UPDATE/DELETE 를 따라가므로 se.py(원문 수집)와
+se_translate.py(번역 채움)가 쓰는 행은 자동으로 색인된다.
+트리거가 fts_chars SQL 함수를 쓰므로 wiki_content 에 쓰는 연결은 ensure_fts 를 거쳐야 한다.
+
+일주·시주 → 구절 색인(wiki_pillar_index)은 수집 시점에 만든다.
+문장 머리(丙寅日癸巳, 丙日癸巳)를 파싱해 (일주 또는 일간, 시주) 키로 저장하므로
+조회는 색인 한 번으로 끝난다.
+"""
+import html
+import os
+import re
+import sqlite3
+
+CTEXT_DB_NAME = os.getenv("CTEXT_DB_NAME", "ctext.db")
+SNIPPET_WIDTH = 24
+# 문장부호·공백 토큰 접두어 (사용자 영역 문자는 unicode61 에서 토큰 문자)
+FTS_GAP = "\ue000"
+# 토큰화 방식이 바뀌면 이 문자열도 바꿔 ensure_fts 가 색인을 다시 만들게 한다
+FTS_TOKENIZE = "unicode61 remove_diacritics 0"
+
+
+def fts_chars(text):
+    """
+    글자 사이에 공백을 넣어 unicode61 이 글자 하나를 토큰 하나로 보게 한다
+    글자·숫자가 아닌 문자는 FTS_GAP + 16진 코드포인트 토큰('，' → '\ue0003001')으로 바꿔
+    구(phrase)가 그 자리를 건너뛰지 않게 한다.
+    """
+    if text is None:
+        return None
+    return " ".join(ch if ch.isalnum() else f"{FTS_GAP}{ord(ch):x}" for ch in text)
+
+
+def ensure_fts(conn):
+    """
+    fts_chars 함수 등록 + FTS 테이블·트리거가 없으면 만들고 기존 행을 색인 (새로 만들었으면 True)
+    예전 trigram 색인이 있으면 지우고 글자 단위로 다시 만든다.
+    """
+    conn.create_function("fts_chars", 1, fts_chars, deterministic=True)
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name='wiki_content_fts'"
+    ).fetchone()
+    if row is not None and FTS_TOKENIZE in row[0]:
+        return False
+    conn.executescript("""
+        DROP TRIGGER IF EXISTS wiki_content_ai;
+        DROP TRIGGER IF EXISTS wiki_content_ad;
+        DROP TRIGGER IF EXISTS wiki_content_au;
+        DROP TABLE IF EXISTS wiki_content_fts;
+        CREATE VIRTUAL TABLE wiki_content_fts USING fts5(
+            content, kr_literal, kr_explained, tokenize='""" + FTS_TOKENIZE + """'
+        );
+        CREATE TRIGGER wiki_content_ai AFTER INSERT ON wiki_content BEGIN
+            INSERT INTO wiki_content_fts (rowid, content, kr_literal, kr_explained)
+            VALUES (new.id, fts_chars(new.content), fts_chars(new.kr_literal), fts_chars(new.kr_explained));
+        END;
+        CREATE TRIGGER wiki_content_ad AFTER DELETE ON wiki_content BEGIN
+            DELETE FROM wiki_content_fts WHERE rowid = old.id;
+        END;
+        CREATE TRIGGER wiki_content_au AFTER UPDATE ON wiki_content BEGIN
+            DELETE FROM wiki_content_fts WHERE rowid = old.id;
+            INSERT INTO wiki_content_fts (rowid, content, kr_literal, kr_explained)
+            VALUES (new.id, fts_chars(new.content), fts_chars(new.kr_literal), fts_chars(new.kr_explained));
+        END;
+        INSERT INTO wiki_content_fts (rowid, content, kr_literal, kr_explained)
+        SELECT id, fts_chars(content), fts_chars(kr_literal), fts_chars(kr_explained) FROM wiki_content;
+    """)
+    conn.commit()
+    return True
+
+
+def init_ctext_index(db_name=CTEXT_DB_NAME):
+    """원문 DB 가 있으면 색인 준비 (없으면 아무것도 하지 않음)"""
+    if not os.path.exists(db_name):
+        return False
+    conn = sqlite3.connect(db_name)
+    try:
+        has_table = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='wiki_content'"
+        ).fetchone()
+        if not has_table:
+            return False
+        created = ensure_fts(conn)
+        return ensure_pillar_index(conn) or created
+    finally:
+        conn.close()
+
+
+def _phrase(term):
+    """검색어 → 글자 단위 구 ('甲子' → "甲 子")"""
+    return '"' + fts_chars(term).replace('"', '""') + '"'
+
+
+def _snippet(texts, terms, width=SNIPPET_WIDTH):
+    """원문 중 검색어가 처음 나오는 열에서 앞뒤 width 글자를 잘라 검색어를 <b> 로 표시"""
+    for text in texts:
+        if not text:
+            continue
+        pos = min((i for i in (text.find(t) for t in terms) if i >= 0), default=-1)
+        if pos < 0:
+            continue
+        start = max(0, pos - width // 2)
+        end = min(len(text), start + width * 2)
+        # 원문은 HTML 이스케이프하고 검색어 자리에만 <b> 를 붙인다
+        part = text[start:end]
+        pattern = re.compile("|".join(re.escape(t) for t in sorted(set(terms), key=len, reverse=True)))
+        out, last = [], 0
+        for m in pattern.finditer(part):
+            out.append(html.escape(part[last:m.start()]))
+            out.append(f"<b>{html.escape(m.group())}</b>")
+            last = m.end()
+        out.append(html.escape(part[last:]))
+        return ("…" if start > 0 else "") + "".join(out) + ("…" if end < len(text) else "")
+    return next((html.escape(t[:width * 2]) for t in texts if t), "")
+
+
+def search(conn, text, page=1, per_page=20):
+    """
+    원문·직역·해설 전체 검색 (bm25 순위, 페이지 단위)
+    → (전체 건수, [{'id', 'section', 'line_number', 'snippet', 'content', 'kr_literal'}])
+    """
+    terms = text.split()
+    if not terms:
+        return 0, []
+    offset = (page - 1) * per_page
+    query = " ".join(_phrase(t) for t in terms)
+    total = conn.execute("SELECT COUNT(*) FROM wiki_content_fts WHERE wiki_content_fts MATCH ?",
+                         (query,)).fetchone()[0]
+    rows = conn.execute("""
+        SELECT w.id, w.section, w.line_number, w.content, w.kr_literal, w.kr_explained
+        FROM wiki_content_fts f JOIN wiki_content w ON w.id = f.rowid
+        WHERE wiki_content_fts MATCH ?
+        ORDER BY bm25(wiki_content_fts) LIMIT ? OFFSET ?
+    """, (query, per_page, offset)).fetchall()
+    return total, [
+        {"id": r[0], "section": r[1], "line_number": r[2], "snippet": _snippet(r[3:6], terms),
+         "content": r[3], "kr_literal": r[4]}
+        for r in rows
+    ]
+
+
+# 丙寅日癸巳 / 丙日癸巳 (일지는 생략될 수 있음)
+_PILLAR_HEAD = re.compile(r"([甲乙丙丁戊己庚辛壬癸])([子丑寅卯辰巳午未申酉戌亥]?)日"
+                          r"([甲乙丙丁戊己庚辛壬癸][子丑寅卯辰巳午未申酉戌亥])")
+_BRANCHES = "子丑寅卯辰巳午未申酉戌亥"
+
+
+def parse_pillar_keys(text):
+    """텍스트 안의 (일주 또는 일간, 시주) 키 집합"""
+    return {(m.group(1) + m.group(2), m.group(3)) for m in _PILLAR_HEAD.finditer(text or "")}
+
+
+def ensure_pillar_index(conn):
+    """
+    구절 색인 테이블이 없으면 만들고 기존 행 전체를 색인 (새로 만들었으면 True)
+    섹션 제목 키까지 담던 예전 형식(source 열)이면 지우고 다시 만든다.
+    """
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(wiki_pillar_index)")]
+    if columns and "source" not in columns:
+        return False
+    conn.execute("DROP TABLE IF EXISTS wiki_pillar_index")
+    conn.execute("""
+        CREATE TABLE wiki_pillar_index (
+            hour_pillar TEXT NOT NULL,
+            day_key TEXT NOT NULL,      -- 일주(丙寅) 또는 일간만(丙)
+            passage_id INTEGER NOT NULL,
+            PRIMARY KEY (hour_pillar, day_key, passage_id)
+        ) WITHOUT ROWID
+    """)
+    for row_id, content in conn.execute("SELECT id, content FROM wiki_content").fetchall():
+        index_passage(conn, row_id, content)
+    conn.commit()
+    return True
+
+
+def index_passage(conn, row_id, content):
+    """행 하나를 구절 색인에 추가 (se.py 가 INSERT 직후 호출)"""
+    conn.executemany(
+        "INSERT OR IGNORE INTO wiki_pillar_index (hour_pillar, day_key, passage_id) VALUES (?, ?, ?)",
+        [(hour, day, row_id) for day, hour in parse_pillar_keys(content)])
+
+
+def pillar_passages(conn, day_pillar, hour_pillar):
+    """(일주, 시주)가 문장 머리에 나오는 행 (id 순) → [(id, content, kr_literal), ...]"""
+    return conn.execute("""
+        SELECT DISTINCT w.id, w.content, w.kr_literal FROM wiki_pillar_index i
+        JOIN wiki_content w ON w.id = i.passage_id
+        WHERE i.hour_pillar = ? AND i.day_key IN (?, ?)
+        ORDER BY w.id
+    """, (hour_pillar, day_pillar, day_pillar[0])).fetchall()
+
+
+def load_pillar_passages(conn):
+    """
+    전체 (일주, 시주) → [(id, content, kr_literal), ...] 매핑을 한 번에 읽기
+    일간만 있는 키는 그 일간의 일주 6개로 펼친다.
+    """
+    mapping = {}
+    for hour, day_key, row_id, content, kr_literal in conn.execute("""
+            SELECT i.hour_pillar, i.day_key, w.id, w.content, w.kr_literal
+            FROM wiki_pillar_index i JOIN wiki_content w ON w.id = i.passage_id"""):
+        if len(day_key) == 2:
+            days = [day_key]
+        else:
+            days = [day_key + z for z in _BRANCHES[_GAN_PARITY[day_key]::2]]
+        for day in days:
+            mapping.setdefault((day, hour), {})[row_id] = (row_id, content, kr_literal)
+    return {k: [v[i] for i in sorted(v)] for k, v in mapping.items()}
+
+
+# 양간은 양지(子寅辰...), 음간은 음지(丑卯巳...)와만 짝을 이룬다
+_GAN_PARITY = {g: i % 2 for i, g in enumerate("甲乙丙丁戊己庚辛壬癸")}
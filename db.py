@@ -0,0 +1,149 @@
+# db.py
+"""
+SQLite 연결 헬퍼
+
+- 쓰기 DB (fortune.db): users, accounts, llm_cache, llm_jobs (user_fortunes·match_reports 는 예전 데이터).
+  WAL 모드라 읽는 쪽이 쓰기 락을 기다리지 않는다.
+  요청 처리 중에는 ConnectionPool 로 스레드별 연결을 재사용한다.
+- 참조 DB (reference.db, ctext.db): 읽기 전용으로 연다.
+  reference.db 는 배포 산출물로 실행 중에는 파일 자체가 교체될 뿐 수정되지 않으므로
+  immutable=1 로 열어 락·변경 확인을 생략한다.
+  ctext.db 는 se.py/se_translate.py 가 채울 수 있으므로 mode=ro 만 쓴다.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+DB_NAME = os.getenv("DB_NAME", "fortune.db")
+REFERENCE_DB_NAME = os.getenv("REFERENCE_DB_NAME", "reference.db")
+REFERENCE_MMAP_SIZE = int(os.getenv("REFERENCE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+def connect_readonly(path, immutable=False, mmap_size=REFERENCE_MMAP_SIZE):
+    """읽기 전용 연결 (파일이 없으면 sqlite3.OperationalError)"""
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True)
+    if mmap_size:
+        conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    return conn
+
+
+def connect_reference(path=REFERENCE_DB_NAME):
+    return connect_readonly(path, immutable=True)
+
+
+def enable_wal(path=DB_NAME):
+    """쓰기 DB 를 WAL 모드로 (DB 파일에 영구 기록되므로 한 번이면 됨)"""
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class ConnectionPool:
+    """
+    스레드마다 연결 하나를 재사용하는 쓰기 DB 연결 관리자
+
+    연결은 autocommit(isolation_level=None)로 열고 쓰기는 transaction() 안에서
+    BEGIN IMMEDIATE 로 처음부터 쓰기 락을 잡는다 (읽기→쓰기 락 승격 중 교착 방지).
+    같은 연결을 계속 쓰므로 sqlite3 의 문장 캐시(cached_statements)가 그대로 재사용된다.
+    fork 전에 만든 연결은 자식 프로세스에서 쓰지 않고 새로 연다.
+    """
+
+    def __init__(self, path=DB_NAME, busy_timeout_ms=5000, cache_size_kib=16384,
+                 cached_statements=256, lock_wait_threshold=0.001):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kib = cache_size_kib
+        self.cached_statements = cached_statements
+        self.lock_wait_threshold = lock_wait_threshold
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.opened = 0
+        self.acquires = 0
+        self.acquire_time = 0.0
+        self.transactions = 0
+        self.lock_waits = 0          # 쓰기 락을 lock_wait_threshold 초 이상 기다린 횟수
+        self.lock_wait_time = 0.0
+        self.busy_errors = 0         # busy_timeout 을 넘겨 database is locked 로 실패한 횟수
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                               isolation_level=None, check_same_thread=True,
+                               cached_statements=self.cached_statements)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = {-int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        return conn
+
+    def connection(self):
+        """현재 스레드의 연결 (없으면 연다)"""
+        start = time.perf_counter()
+        if os.getpid() != self._pid:
+            # fork 된 워커: 부모의 연결·통계는 버린다
+            self._pid = os.getpid()
+            self._local = threading.local()
+            with self._stats_lock:
+                self._reset_stats()
+        conn = getattr(self._local, "conn", None)
+        opened = conn is None
+        if opened:
+            conn = self._local.conn = self._open()
+        with self._stats_lock:
+            self.acquires += 1
+            self.opened += opened
+            self.acquire_time += time.perf_counter() - start
+        return conn
+
+    def execute(self, sql, params=()):
+        """읽기 전용 쿼리 (autocommit)"""
+        return self.connection().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """쓰기 트랜잭션: 정상 종료 시 COMMIT, 예외 시 ROLLBACK"""
+        conn = self.connection()
+        start = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            with self._stats_lock:
+                self.busy_errors += 1
+            raise
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.transactions += 1
+            self.lock_wait_time += waited
+            if waited >= self.lock_wait_threshold:
+                self.lock_waits += 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "path": self.path,
+                "connections": self.opened,
+                "acquires": self.acquires,
+                "avg_acquire_us": round(self.acquire_time / self.acquires * 1e6, 2) if self.acquires else 0.0,
+                "transactions": self.transactions,
+                "lock_waits": self.lock_waits,
+                "lock_wait_ms": round(self.lock_wait_time * 1000, 2),
+                "busy_errors": self.busy_errors,
+            }
@@ -1,6 +1,6 @@
 # four_pillars.py
 from datetime import datetime, timedelta
-import sxtwl
+from pillar_table import pillar_codes, pillars_to_dict
 
 # GAN = "갑을병정무기경신임계"   # 天干 0~9
 # ZHI = "자축인묘진사오미신유술해" # 地支 0~11
@@ -17,19 +17,9 @@ def four_pillars_from_gmt(gmt_dt: datetime, tz_offset_hours: int = 9) -> dict:
     # UTC → 현지시간으로 변환
     local_dt = gmt_dt + timedelta(hours=tz_offset_hours)
 
-    # 사주 계산
-    day = sxtwl.fromSolar(local_dt.year, local_dt.month, local_dt.day)
-    y_gz = day.getYearGZ(False)
-    m_gz = day.getMonthGZ()
-    d_gz = day.getDayGZ()
-    h_gz = day.getHourGZ(local_dt.hour)
-
-    return {
-        "year": GAN[y_gz.tg] + ZHI[y_gz.dz],
-        "month": GAN[m_gz.tg] + ZHI[m_gz.dz],
-        "day": GAN[d_gz.tg] + ZHI[d_gz.dz],
-        "hour": GAN[h_gz.tg] + ZHI[h_gz.dz],
-    }
+    # 사주 계산 (사전 계산 테이블, 범위 밖은 sxtwl)
+    codes = pillar_codes(local_dt.year, local_dt.month, local_dt.day, local_dt.hour)
+    return pillars_to_dict(codes)
 
 if __name__ == "__main__":
     # 예시: 1984‑06‑01 11:30 UTC → 한국시간 20:30 → 갑자·기사·병인·무술
@@ -0,0 +1,25 @@
+# gunicorn.conf.py
+import gc
+import os
+
+# 앱(참조 데이터, 기둥 테이블 등)을 마스터에서 한 번 import 한 뒤 fork
+# DB 스키마·참조 DB 는 미리 한 번 준비해 둔다: flask --app main init-db
+preload_app = True
+
+# 스레드 워커: AI 해석 스트리밍(/api/saju_ai_analysis/stream, SSE)은 GPT 응답이 끝날 때까지
+# 연결을 붙잡으므로 동기(sync) 워커면 그동안 워커 전체가 막힌다.
+# gthread 는 요청마다 스레드 하나만 쓰므로 나머지 스레드가 다른 요청을 처리한다.
+# 워커당 동시 요청 수 = threads (동시 스트림이 많으면 GUNICORN_THREADS 를 늘린다)
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+
+def when_ready(server):
+    # 프리로드된 객체를 GC 추적에서 빼서 fork 후 copy-on-write 로 복사되는 페이지를 줄인다
+    gc.freeze()
+
+
+def worker_exit(server, worker):
+    # 워커 종료 전에 방문 기록 큐에 남은 것을 기록 (atexit 보다 먼저, 확실하게)
+    from main import visit_writer
+    visit_writer.close()
@@ -0,0 +1,130 @@
+# jobs.py
+"""
+LLM 호출용 백그라운드 작업 큐
+
+요청은 submit() 으로 작업 id 만 받아 바로 돌아가고, 워커 프로세스 안의
+제한된 스레드 풀이 LLM 을 호출한다. 상태·결과는 SQLite(llm_jobs)에 저장하므로
+다른 gunicorn 워커로 들어온 상태 조회 요청도 같은 결과를 본다.
+
+상태: pending → running → done | error
+실행 중이던 프로세스가 죽어 JOB_TIMEOUT 초가 지나도록 끝나지 않은 작업은 조회 시 error 로 보인다.
+오래된 작업 행은 purge-fortunes(maintenance.purge_old_jobs)가 지운다.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+JOB_TIMEOUT = 300
+
+
+class QueueFull(Exception):
+    """대기 중인 작업이 max_pending 을 넘음 (잠시 후 재시도)"""
+
+
+class JobQueue:
+    def __init__(self, pool, max_workers=4, max_pending=64, timeout=JOB_TIMEOUT):
+        self._pool = pool                  # db.ConnectionPool
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-job")
+        self._lock = threading.Lock()
+        self._active = 0                   # 이 프로세스에서 대기·실행 중인 작업 수
+        self._done = {}                    # job id → threading.Event (이 프로세스에서 실행한 작업)
+        self.submitted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.run_time = 0.0
+
+    def submit(self, kind, owner, fn, *args):
+        """작업 등록 후 id 반환 (fn(*args) 의 반환 문자열이 결과, 예외는 error)"""
+        with self._lock:
+            if self._active >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(kind)
+            self._active += 1
+            self.submitted += 1
+        job_id = uuid.uuid4().hex
+        try:
+            with self._pool.transaction() as conn:
+                conn.execute("INSERT INTO llm_jobs (id, kind, owner, status, created) VALUES (?, ?, ?, 'pending', ?)",
+                             (job_id, kind, owner, datetime.now()))
+            self._done[job_id] = threading.Event()
+            self._executor.submit(self._run, job_id, fn, args)
+        except BaseException:
+            with self._lock:
+                self._active -= 1
+            raise
+        return job_id
+
+    def _run(self, job_id, fn, args):
+        start = time.perf_counter()
+        try:
+            with self._pool.transaction() as conn:
+                conn.execute("UPDATE llm_jobs SET status = 'running', started = ? WHERE id = ?",
+                             (datetime.now(), job_id))
+            try:
+                result, error = fn(*args), None
+            except Exception as e:
+                result, error = None, str(e)
+            with self._pool.transaction() as conn:
+                conn.execute("UPDATE llm_jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                             ("done" if error is None else "error", result, error, datetime.now(), job_id))
+            with self._lock:
+                self.run_time += time.perf_counter() - start
+                if error is None:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+        finally:
+            with self._lock:
+                self._active -= 1
+            event = self._done.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+    def get(self, job_id):
+        """→ {'id', 'kind', 'owner', 'status', 'result', 'error', 'created', 'finished'} 또는 None"""
+        row = self._pool.execute(
+            "SELECT id, kind, owner, status, result, error, created, finished FROM llm_jobs WHERE id = ?",
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "kind", "owner", "status", "result", "error", "created", "finished"), row))
+        if job["status"] in ("pending", "running") and job_id not in self._done:
+            # 다른 프로세스의 작업: 너무 오래되면 실행하던 워커가 죽은 것으로 본다
+            created = datetime.fromisoformat(str(job["created"]))
+            if (datetime.now() - created).total_seconds() > self.timeout:
+                job["status"], job["error"] = "error", "작업 시간이 초과되었습니다"
+        return job
+
+    def wait(self, job_id, timeout):
+        """작업이 끝나거나 timeout 초가 지날 때까지 기다린 뒤 get()"""
+        event = self._done.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+        else:
+            deadline = time.monotonic() + timeout
+            while True:
+                job = self.get(job_id)
+                if job is None or job["status"] in ("done", "error") or time.monotonic() >= deadline:
+                    return job
+                time.sleep(min(0.25, max(0.0, deadline - time.monotonic())))
+        return self.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            finished = self.succeeded + self.failed
+            return {
+                "active": self._active,
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "avg_run_ms": round(self.run_time / finished * 1000, 1) if finished else 0.0,
+            }
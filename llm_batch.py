@@ -0,0 +1,73 @@
+# llm_batch.py
+"""
+LLM 일괄 생성 도우미 (야간 사전 생성 등)
+
+- RateLimiter: 토큰 버킷, 초당 rate 회로 호출을 고르게 분산 (스레드 안전)
+- run_batch: 동시 실행 수 제한 + 실패 시 지수 백오프 재시도
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class RateLimiter:
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("rate 는 0 보다 커야 합니다")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """토큰 하나를 얻을 때까지 대기"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def run_batch(items, fn, concurrency=4, retries=3, limiter=None, backoff=2.0):
+    """
+    items 각각에 fn(item) 실행 → {'succeeded', 'failed': [(item, 오류)], 'attempts', 'elapsed'}
+    실패하면 backoff * 2^(시도-1) 초 (+지터) 뒤 최대 retries 번 다시 시도한다.
+    호출마다 limiter.acquire() 로 속도를 제한한다 (재시도 포함).
+    """
+    attempts = 0
+    lock = threading.Lock()
+
+    def run(item):
+        nonlocal attempts
+        for attempt in range(1, retries + 2):
+            if limiter is not None:
+                limiter.acquire()
+            with lock:
+                attempts += 1
+            try:
+                fn(item)
+                return None
+            except Exception as e:
+                if attempt > retries:
+                    return e
+                time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.8, 1.2))
+
+    start = time.monotonic()
+    succeeded, failed = 0, []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llm-batch") as executor:
+        futures = {executor.submit(run, item): item for item in items}
+        for future in as_completed(futures):
+            error = future.result()
+            if error is None:
+                succeeded += 1
+            else:
+                failed.append((futures[future], error))
+    return {"succeeded": succeeded, "failed": failed, "attempts": attempts,
+            "elapsed": round(time.monotonic() - start, 1)}
@@ -0,0 +1,296 @@
+# llm_cache.py
+"""
+LLM 응답 공용 캐시
+
+프롬프트는 명식(또는 명식 쌍)·메뉴·날짜로만 정해지므로 결과를
+(템플릿, 템플릿 버전, 날짜 구간, 명식 코드) 키 하나로 모든 방문자가 공유한다.
+
+- 템플릿 문구를 바꾸면 TEMPLATES 의 버전을 올린다 → 예전 결과는 더 이상 맞지 않고 축출로 사라진다.
+- bucket="day" 템플릿(오늘의 운세 등)은 날짜가 키에 들어가고, None 이면 날짜와 무관하다.
+- 저장은 SQLite(llm_cache, 워커 간 공유), 프로세스 안에서는 LRU 로 한 번 더 캐시한다.
+  메모리 적중도 TOUCH_INTERVAL 마다 last_used 를 갱신해 축출 순서에 반영한다.
+- 전체 크기가 max_bytes 를 넘으면 오래 쓰이지 않은 것부터 지운다.
+- 오류 응답은 저장하지 않는다 (호출하는 쪽에서 예외로 처리).
+
+get_or_generate 는 키마다 생성을 한 번만 돌린다 (single-flight):
+- 같은 프로세스: 먼저 온 스레드만 생성하고 나머지는 그 결과(또는 예외)를 기다린다.
+- 워커 간: llm_leases 에 만료 시각이 있는 임대 행을 잡은 쪽만 생성하고, 나머지는
+  결과가 llm_cache 에 저장될 때까지 폴링한다. 임대가 풀리거나 만료되면(워커가 죽은 경우)
+  기다리던 쪽이 임대를 가져가 직접 생성한다.
+스트리밍처럼 생성을 함수 하나로 감쌀 수 없으면 generation() 구간을 직접 쓴다.
+"""
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from cache import LRUCache
+
+# 템플릿 이름 → (버전, 날짜 구간)
+TEMPLATES = {
+    "saju_analysis": (1, None),     # /api/saju_ai_analysis 통합 해석 (명식)
+    "daily_fortune": (1, "day"),    # generate_fortune 오늘의 운세 (연간지 + 시지)
+    "saju_summary": (1, None),      # generate_saju_analysis (연간지 + 시지)
+    "match_preview": (1, None),     # 궁합 미리보기 (명식 쌍)
+    "match_report": (1, None),      # 궁합 정밀 리포트 (명식 쌍)
+}
+
+LLM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# last_used 는 이 간격보다 오래됐을 때만 갱신 (조회마다 쓰기를 하지 않도록)
+TOUCH_INTERVAL = 3600
+# 생성 임대 유지 시간 (LLM 호출 최대 시간보다 길게), 다른 워커의 결과를 기다리는 폴링 간격
+LEASE_TTL = 120
+LEASE_POLL_INTERVAL = 0.2
+
+
+def date_bucket(bucket, now=None):
+    if bucket is None:
+        return "-"
+    if bucket == "day":
+        return (now or datetime.now()).strftime("%Y-%m-%d")
+    raise ValueError(f"알 수 없는 날짜 구간: {bucket}")
+
+
+def cache_key(template, subject, now=None):
+    version, bucket = TEMPLATES[template]
+    return f"{template}:v{version}:{date_bucket(bucket, now)}:{subject}"
+
+
+class _Slot:
+    """generation() 이 넘겨주는 결과 자리"""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Interrupted(Exception):
+    """생성 담당자가 끝내지 못하고 빠짐 (스트리밍 클라이언트 연결 끊김 등)"""
+
+
+class _Flight:
+    """프로세스 안에서 진행 중인 생성 하나 (기다리는 스레드에 결과·예외 전달)"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LLMCache:
+    def __init__(self, pool, max_bytes=LLM_CACHE_MAX_BYTES, memory_size=512, evict_every=50,
+                 lease_ttl=LEASE_TTL, poll_interval=LEASE_POLL_INTERVAL):
+        self._pool = pool                  # db.ConnectionPool
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._memory = LRUCache("llm_results", memory_size)   # 키 → (결과, last_used 갱신 monotonic 시각)
+        self._lock = threading.Lock()
+        self._flights = {}                 # 캐시 키 → _Flight
+        self._puts = 0
+        self._stats = {name: {"hits": 0, "memory_hits": 0, "misses": 0, "stores": 0,
+                              "generated": 0, "coalesced": 0, "lease_waits": 0}
+                       for name in TEMPLATES}
+        self.evictions = 0
+
+    def _count(self, template, field):
+        with self._lock:
+            self._stats[template][field] += 1
+
+    def get(self, template, subject, now=None):
+        key = cache_key(template, subject, now)
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._count(template, "memory_hits")
+            self._count(template, "hits")
+            value, touched = entry
+            # 메모리 적중도 축출 순서(last_used)에 반영해야 자주 쓰는 결과가 먼저 지워지지 않는다
+            if time.monotonic() - touched > TOUCH_INTERVAL:
+                self._touch(key)
+                self._memory.put(key, (value, time.monotonic()))
+            return value
+        row = self._pool.execute("SELECT result, last_used FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count(template, "misses")
+            return None
+        self._count(template, "hits")
+        value, last_used = row
+        age = None if last_used is None else (datetime.now() - datetime.fromisoformat(str(last_used))).total_seconds()
+        if age is None or age > TOUCH_INTERVAL:
+            self._touch(key)
+            age = 0
+        self._memory.put(key, (value, time.monotonic() - age))
+        return value
+
+    def _touch(self, key):
+        with self._pool.transaction() as conn:
+            conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (datetime.now(), key))
+
+    def put(self, template, subject, value, now=None):
+        key = cache_key(template, subject, now)
+        version, _bucket = TEMPLATES[template]
+        now_ts = datetime.now()
+        with self._pool.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, template, version, result, bytes, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, template, version, value, len(value.encode("utf-8")), now_ts, now_ts))
+        self._memory.put(key, (value, time.monotonic()))
+        self._count(template, "stores")
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def get_or_generate(self, template, subject, generate, now=None):
+        """
+        캐시에 없으면 generate() 결과를 저장 후 반환 (예외는 저장하지 않고 그대로 전파)
+        같은 키를 동시에 요청하면 generate() 는 한 번만 실행되고 모두 같은 결과를 받는다.
+        """
+        with self.generation(template, subject, now) as slot:
+            if slot.value is None:
+                slot.value = generate()
+        return slot.value
+
+    @contextmanager
+    def generation(self, template, subject, now=None):
+        """
+        single-flight 생성 구간 (스트리밍처럼 generate() 하나로 감쌀 수 없는 생성용)
+
+            with llm_cache.generation(template, subject) as slot:
+                if slot.value is None:
+                    slot.value = ...   # 이 호출자가 생성 담당, 정상 종료 시 저장
+            slot.value                 # 캐시 또는 다른 스레드·워커가 만든 결과
+
+        다른 쪽이 생성 중이면 들어갈 때 그 결과를 기다린다. 담당자가 예외로 끝나면
+        같은 프로세스에서 기다리던 쪽도 같은 예외를 받고, 결과는 저장하지 않는다.
+        """
+        slot = _Slot(self.get(template, subject, now))
+        if slot.value is not None:
+            yield slot
+            return
+        key = cache_key(template, subject, now)
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+            if leader:
+                break
+            if not flight.done.wait(self.lease_ttl * 2):
+                raise TimeoutError(f"LLM 생성 대기 시간 초과: {key}")
+            if isinstance(flight.error, _Interrupted):
+                continue    # 담당자가 중간에 끊김 → 기다리던 쪽이 다시 맡는다
+            self._count(template, "coalesced")
+            if flight.error is not None:
+                raise flight.error
+            slot.value = flight.value
+            yield slot
+            return
+        owner = None
+        try:
+            slot.value, owner = self._lease_or_result(template, key)
+            if owner is not None:
+                try:
+                    yield slot
+                    if slot.value is None:
+                        raise RuntimeError(f"생성 결과가 없습니다: {key}")
+                    self._count(template, "generated")
+                    self.put(template, subject, slot.value, now)
+                finally:
+                    with self._pool.transaction() as conn:
+                        conn.execute("DELETE FROM llm_leases WHERE key = ? AND owner = ?", (key, owner))
+            flight.value = slot.value
+        except Exception as e:
+            flight.error = e
+            raise
+        except BaseException:
+            # 스트리밍 응답을 클라이언트가 끊은 경우(GeneratorExit) 등
+            flight.error = _Interrupted(key)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        if owner is None:
+            # 다른 워커가 만든 결과
+            yield slot
+
+    def _lease_or_result(self, template, key):
+        """
+        워커 간 임대를 잡으면 (None, owner), 다른 워커가 생성을 끝내면 (결과, None)
+        임대가 풀리거나 만료되면(워커가 죽은 경우) 기다리던 쪽이 임대를 가져간다.
+        """
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        waited = False
+        while not self._acquire_lease(key, owner):
+            if not waited:
+                waited = True
+                self._count(template, "lease_waits")
+            time.sleep(self.poll_interval)
+            value = self._stored(template, key)
+            if value is not None:
+                return value, None
+        # get() 이 미스였어도 그사이 다른 워커가 저장하고 임대를 풀었을 수 있다 (기다리지 않았어도 확인)
+        value = self._stored(template, key)
+        if value is not None:
+            with self._pool.transaction() as conn:
+                conn.execute("DELETE FROM llm_leases WHERE key = ? AND owner = ?", (key, owner))
+            return value, None
+        return None, owner
+
+    def _stored(self, template, key):
+        """다른 워커가 저장한 결과 (적중·미스 통계에는 넣지 않음)"""
+        row = self._pool.execute("SELECT result FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._memory.put(key, (row[0], time.monotonic()))
+        self._count(template, "coalesced")
+        return row[0]
+
+    def _acquire_lease(self, key, owner):
+        now_ts = time.time()
+        with self._pool.transaction() as conn:
+            conn.execute("DELETE FROM llm_leases WHERE key = ? AND expires < ?", (key, now_ts))
+            cur = conn.execute("INSERT OR IGNORE INTO llm_leases (key, owner, expires) VALUES (?, ?, ?)",
+                               (key, owner, now_ts + self.lease_ttl))
+            return cur.rowcount == 1
+
+    def evict(self):
+        """전체 크기가 max_bytes 를 넘으면 last_used 가 오래된 것부터 삭제 → 지운 행 수"""
+        removed = 0
+        with self._pool.transaction() as conn:
+            # 생성 도중 죽은 워커가 남긴 임대
+            conn.execute("DELETE FROM llm_leases WHERE expires < ?", (time.time(),))
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM llm_cache").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            excess = total - self.max_bytes
+            victims = []
+            for key, size in conn.execute("SELECT key, bytes FROM llm_cache ORDER BY last_used"):
+                victims.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+            removed = len(victims)
+        for (key,) in victims:
+            self._memory.discard(key)
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            templates = {}
+            for name, s in self._stats.items():
+                lookups = s["hits"] + s["misses"]
+                templates[name] = dict(s, version=TEMPLATES[name][0],
+                                       hit_rate=round(s["hits"] / lookups, 4) if lookups else 0.0)
+            return {"templates": templates, "evictions": self.evictions, "max_bytes": self.max_bytes,
+                    "in_flight": len(self._flights)}
@@ -1,15 +1,32 @@
 
-from flask import Flask, request, session, redirect, render_template
-from flask import send_file
+from flask import Flask, request, session, redirect, render_template, g, has_request_context
+from flask import send_file, Response, stream_with_context
 from io import BytesIO
 from fpdf import FPDF
-import os, sqlite3, uuid, hashlib
+import os, sqlite3, uuid, hashlib, threading, time, sys
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import openai
+import click
+import json
 import re
-import sxtwl
 import random
+from concurrent.futures import ThreadPoolExecutor
+from pillar_table import GANZHI, batch_pillar_codes, pillar_codes, pillars_to_dict
+from chart import Chart
+from cache import LRUCache, all_cache_stats, freeze
+from chart_store import load_store
+from ctext_index import CTEXT_DB_NAME, init_ctext_index, search as search_ctext
+from reference_data import (EMPTY_ILJU, ILJU_CSV_PATH, build_reference_db, get_reference_data,
+                            preload_reference_data, reference_data_stats, reload_reference_data)
+from write_behind import WriteBehindQueue
+from jobs import JobQueue, QueueFull
+from llm_cache import LLM_CACHE_MAX_BYTES, LLMCache
+from llm_batch import RateLimiter, run_batch
+from maintenance import (FORTUNE_RETENTION_DAYS, JOB_RETENTION_HOURS, enable_incremental_vacuum,
+                         format_report, run_retention)
+from migrations import SCHEMA_VERSION, migrate, schema_version
+from db import DB_NAME, REFERENCE_DB_NAME, ConnectionPool, connect_readonly, enable_wal
 
 # -------- 유틸릴리 함수 ------------------------------
 # --- 三命通会 원문 해석 (ctext) 유틸리티 함수 ---
@@ -19,16 +36,19 @@ def normalize_section_key(day_pillar, hour_pillar):
     hour_branch = hour_pillar[1]
     return f"六{day_stem}日{hour_branch}时断"
 
+def reference_data():
+    """요청 안에서는 처음 받은 스냅샷을 g 에 고정 (요청 도중 교체되어도 일관되게)"""
+    if not has_request_context():
+        return get_reference_data()
+    if "reference_data" not in g:
+        g.reference_data = get_reference_data()
+    return g.reference_data
+
+
 def get_ctext_match(day_pillar, hour_pillar):
-    keyword1 = f"{day_pillar}日{hour_pillar}"     # ex: 丙寅日癸巳
-    keyword2 = f"{day_pillar[0]}日{hour_pillar}"  # ex: 丙日癸巳
-    conn = sqlite3.connect("ctext.db")
-    c = conn.cursor()
-    c.execute("SELECT content, kr_literal FROM wiki_content WHERE content LIKE ? OR content LIKE ?", 
-              (f"%{keyword1}%", f"%{keyword2}%"))
-    rows = c.fetchall()
-    conn.close()
-    return [{"content": r[0], "kr_literal": r[1]} for r in rows if r[0]] if rows else None
+    # 문장 머리 丙寅日癸巳 / 丙日癸巳 로 색인된 구절 (참조 데이터에 미리 읽어 둠)
+    entry = reference_data().ctext.get((day_pillar, hour_pillar))
+    return [{"content": c, "kr_literal": k} for c, k in entry.rows] if entry else None
 
 def get_hour_branch(hour):
     branches = earthly_branches
@@ -36,18 +56,12 @@ def get_hour_branch(hour):
     return branches[index]
 
 def calculate_four_pillars(dt: datetime) -> dict:
-    day = sxtwl.fromSolar(dt.year, dt.month, dt.day)
-    y_gz = day.getYearGZ(False)
-    m_gz = day.getMonthGZ()
-    d_gz = day.getDayGZ()
-    h_gz = day.getHourGZ(dt.hour)
+    # 사전 계산 테이블 조회 (범위 밖은 pillar_table 내부에서 sxtwl 로 계산)
+    return pillars_to_dict(pillar_codes(dt.year, dt.month, dt.day, dt.hour))
 
-    return {
-        "year": GAN[y_gz.tg] + ZHI[y_gz.dz],
-        "month": GAN[m_gz.tg] + ZHI[m_gz.dz],
-        "day": GAN[d_gz.tg] + ZHI[d_gz.dz],
-        "hour": GAN[h_gz.tg] + ZHI[h_gz.dz],
-    }
+def calculate_chart(dt: datetime) -> Chart:
+    """calculate_four_pillars 의 정수 코드 버전"""
+    return Chart(*pillar_codes(dt.year, dt.month, dt.day, dt.hour))
 
 def four_pillars_from_gmt(gmt_dt: datetime, tz_offset_hours: int = 9) -> dict:
     """
@@ -58,18 +72,7 @@ def four_pillars_from_gmt(gmt_dt: datetime, tz_offset_hours: int = 9) -> dict:
     local_dt = gmt_dt + timedelta(hours=tz_offset_hours)
 
     # 사주 계산
-    day = sxtwl.fromSolar(local_dt.year, local_dt.month, local_dt.day)
-    y_gz = day.getYearGZ(False)
-    m_gz = day.getMonthGZ()
-    d_gz = day.getDayGZ()
-    h_gz = day.getHourGZ(local_dt.hour)
-
-    return {
-        "year": GAN[y_gz.tg] + ZHI[y_gz.dz],
-        "month": GAN[m_gz.tg] + ZHI[m_gz.dz],
-        "day": GAN[d_gz.tg] + ZHI[d_gz.dz],
-        "hour": GAN[h_gz.tg] + ZHI[h_gz.dz],
-    }
+    return calculate_four_pillars(local_dt)
 
 # Helper: 재계산용
 def calc_pillars_from_session(birthdate, birthtime, tz_name):
@@ -88,120 +91,107 @@ BUY_ME_A_COFFEE_LINK = os.getenv("BUY_ME_A_COFFEE_LINK")
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "supersecretpowerisaigo!")
 
-DB_NAME = "fortune.db"
-
-# DB 초기화
+# DB 초기화 (스키마는 migrations.py 에서 버전 관리)
+# 배포 시 워커를 띄우기 전에 한 번만 실행: flask --app main init-db
+# 워커 import 는 DB 에 쓰지 않는다 (동시에 뜨는 워커끼리 DDL 경쟁 없음)
 def init_db():
     conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            email TEXT,
-            birthdate TEXT,
-            birthhour INTEGER,
-            session_token TEXT,
-            first_visit TIMESTAMP,
-            last_visit TIMESTAMP,
-            visit_count INTEGER DEFAULT 1
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS user_fortunes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT,
-            menu TEXT,
-            date TEXT,
-            result TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS saju_interpretations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type INTEGER,
-            ilju TEXT,
-            cn TEXT,
-            kr TEXT,
-            en TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS match_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            key TEXT UNIQUE,
-            report TEXT,
-            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    # CSV에서 사주 해석 불러오기 및 삽입
-    import csv
-    csv_path = "ilju_db.csv"
-    c.execute("SELECT COUNT(*) FROM saju_interpretations")
-    existing_count = c.fetchone()[0]
-
-    if existing_count == 0 and os.path.exists(csv_path):
-        with open(csv_path, newline='', encoding='utf-8') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                if len(row) < 5:
-                    continue  # 잘못된 행은 건너뜀
-                row = [item.strip() for item in row]
-                if row[0].startswith('\ufeff'):
-                    row[0] = row[0].replace('\ufeff', '')
-                type_str, ilju, cn, kr, en = row
-                c.execute('''
-                    INSERT INTO saju_interpretations (type, ilju, cn, kr, en)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (int(type_str), ilju, cn, kr, en))
-        conn.commit()
-    conn.close()
-
-init_db()
+    try:
+        applied = migrate(conn)
+    finally:
+        conn.close()
+    # 보존 정책(purge-fortunes)용 auto_vacuum 전환: 처음 한 번 전체 VACUUM 이라 워커가 뜨기 전에
+    conn = sqlite3.connect(DB_NAME, isolation_level=None, timeout=30)
+    try:
+        vacuum_converted = enable_incremental_vacuum(conn)
+    finally:
+        conn.close()
+    enable_wal(DB_NAME)
+    # 일주 해석 참조 DB (CSV 체크섬이 같으면 건너뜀), 三命通会 색인
+    loaded = build_reference_db(REFERENCE_DB_NAME, ILJU_CSV_PATH) if os.path.exists(ILJU_CSV_PATH) else None
+    init_ctext_index()
+    return {"migrations": applied, "reference_rows": loaded, "vacuum_converted": vacuum_converted}
+
+@app.cli.command("init-db")
+def init_db_command():
+    result = init_db()
+    print(f"스키마 적용: {result['migrations'] or '없음'}, "
+          f"일주 해석: {'변경 없음' if result['reference_rows'] is None else str(result['reference_rows']) + '건'}")
+    if result["vacuum_converted"]:
+        print("auto_vacuum 을 INCREMENTAL 로 전환했습니다 (purge-fortunes 가 파일 크기를 줄임)")
+
+@app.cli.command("purge-fortunes")
+@click.option("--days", default=FORTUNE_RETENTION_DAYS, show_default=True, help="보존 일수")
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--archive", "archive_path", default=None, help="지우기 전에 옮겨 둘 SQLite 파일")
+@click.option("--job-hours", default=JOB_RETENTION_HOURS, show_default=True, help="LLM 작업(llm_jobs) 보존 시간")
+def purge_fortunes_command(days, batch_size, archive_path, job_hours):
+    print(format_report(run_retention(DB_NAME, days, batch_size, archive_path, job_hours)))
+
+def check_db_ready():
+    """import 시점 확인 (읽기만): init-db 를 안 돌렸으면 경고"""
+    try:
+        conn = connect_readonly(DB_NAME, mmap_size=0)
+        try:
+            version = schema_version(conn)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        version = 0
+    if version < SCHEMA_VERSION:
+        print(f"⚠️ {DB_NAME} 스키마 버전 {version} < {SCHEMA_VERSION}: 'flask --app main init-db' 를 먼저 실행하세요")
+    if not os.path.exists(REFERENCE_DB_NAME):
+        print(f"⚠️ 참조 DB {REFERENCE_DB_NAME} 가 없습니다: 'flask --app main init-db' 를 먼저 실행하세요")
+
+check_db_ready()
+# 요청 처리용 쓰기 DB 연결 (스레드별 재사용, WAL + busy timeout)
+user_db = ConnectionPool(DB_NAME)
+# LLM 호출 작업 큐 (워커 프로세스당 스레드 LLM_JOB_WORKERS 개)
+# LLM 응답 공용 캐시 (명식 코드 + 템플릿 버전 + 날짜 구간)
+llm_cache = LLMCache(user_db, max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(LLM_CACHE_MAX_BYTES))))
+llm_jobs = JobQueue(user_db, max_workers=int(os.getenv("LLM_JOB_WORKERS", "4")),
+                    max_pending=int(os.getenv("LLM_JOB_QUEUE", "64")))
+# 참조 데이터는 fork 전에 한 번 읽어 워커들이 공유 (gunicorn preload_app)
+preload_reference_data(REFERENCE_DB_NAME, CTEXT_DB_NAME)
 
 # 세션 토큰 생성
 def generate_session_token(email):
     raw = f"{email}-{str(uuid.uuid4())}"
     return hashlib.sha256(raw.encode()).hexdigest()
 
-def get_today_string():
-    return datetime.now().strftime("%Y-%m-%d")
+# 방문자 식별: 세션 쿠키의 방문자 id + 생년월일시·성별 해시
+# 같은 브라우저에서 같은 정보로 다시 제출하면 같은 가상 이메일이 되어 users 행·오늘의 운세를 재사용
+def visitor_email(visitor_id, birthdate, birthhour, gender):
+    raw = f"{visitor_id}|{birthdate}|{birthhour}|{gender}"
+    return f"user_{hashlib.sha256(raw.encode()).hexdigest()[:16]}@nomail.com"
 
-def get_fortune_from_db(email, menu):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT result FROM user_fortunes WHERE email=? AND menu=? AND date=?",
-              (email, menu, get_today_string()))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-def save_fortune_to_db(email, menu, result):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO user_fortunes (email, menu, date, result) VALUES (?, ?, ?, ?)",
-              (email, menu, get_today_string(), result))
-    conn.commit()
-    conn.close()
-
-# 유저 저장 또는 업데이트
+# 유저 저장 또는 업데이트 (방문 기록은 백그라운드에서 모아서 한 트랜잭션으로 기록)
 def save_or_update_user(name, email, birthdate, birthhour, session_token):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT id, visit_count FROM users WHERE email = ? AND session_token = ?", (email, session_token))
-    existing = c.fetchone()
-    now = datetime.now()
-    if existing:
-        c.execute("UPDATE users SET last_visit = ?, visit_count = ? WHERE id = ?",
-                  (now, existing[1] + 1, existing[0]))
-    else:
-        c.execute('''
-            INSERT INTO users (name, email, birthdate, birthhour, session_token, first_visit, last_visit)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (name, email, birthdate, birthhour, session_token, now, now))
-    conn.commit()
-    conn.close()
+    visit_writer.put((name, email, birthdate, birthhour, session_token, datetime.now()))
+
+def write_visits(events):
+    # 같은 유저의 방문은 한 번의 UPDATE/INSERT 로 합친다
+    visits = {}
+    for name, email, birthdate, birthhour, session_token, now in events:
+        v = visits.get((email, session_token))
+        if v is None:
+            visits[(email, session_token)] = [name, birthdate, birthhour, now, now, 1]
+        else:
+            v[4] = max(v[4], now)
+            v[5] += 1
+    # (email, session_token) UNIQUE 인덱스 기준 upsert: 행마다 조회 없이 한 문장
+    with user_db.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO users (name, email, birthdate, birthhour, session_token, first_visit, last_visit, visit_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (email, session_token) DO UPDATE SET
+                last_visit = excluded.last_visit,
+                visit_count = COALESCE(users.visit_count, 0) + excluded.visit_count
+        ''', [(name, email, birthdate, birthhour, session_token, first, last, count)
+              for (email, session_token), (name, birthdate, birthhour, first, last, count) in visits.items()])
+
+VISIT_QUEUE_SIZE = int(os.getenv("VISIT_QUEUE_SIZE", "10000"))
+visit_writer = WriteBehindQueue("visits", write_visits, maxsize=VISIT_QUEUE_SIZE)
 
 def format_fortune_text(text):
     # 마침표와 종결 어미 기준으로 문장 분리
@@ -216,6 +206,54 @@ def format_fortune_text(text):
 
     return '<br><br>'.join(result)
 
+class FortuneTextStream:
+    """
+    format_fortune_text 의 스트리밍 버전
+    조각을 feed() 할 때마다 끝난 문장만 서식을 입혀 돌려준다.
+    (문장 끝 뒤 공백이 이어질 수 있으므로 다음 글자가 와야 문장이 끝난 것으로 본다)
+    모든 조각을 이어 붙인 결과(text)는 format_fortune_text(전체 텍스트)와 같다.
+    """
+    _SENTENCE_END = re.compile(r'(?<=[다요]\.)\s*')
+    _KEYWORDS = re.compile(r'(재물|성공|조심|노력|행운|사랑|건강|위험)')
+
+    def __init__(self):
+        self._buf = ""
+        self._started = False
+        self._parts = []
+
+    def feed(self, delta):
+        if not self._started:
+            delta = delta.lstrip()
+            if not delta:
+                return ""
+            self._started = True
+        self._buf += delta
+        sentences, pos = [], 0
+        for m in self._SENTENCE_END.finditer(self._buf):
+            if m.end() == len(self._buf):
+                break
+            sentences.append(self._buf[pos:m.start()])
+            pos = m.end()
+        self._buf = self._buf[pos:]
+        return self._emit(sentences)
+
+    def finish(self):
+        rest, self._buf = self._buf.rstrip(), ""
+        return self._emit(self._SENTENCE_END.split(rest))
+
+    def _emit(self, sentences):
+        out = []
+        for sentence in sentences:
+            sentence = self._KEYWORDS.sub(r'<b>\1</b>', sentence)
+            if sentence:
+                out.append(('<br><br>' if self._parts or out else '') + sentence.strip())
+        self._parts.extend(out)
+        return ''.join(out)
+
+    @property
+    def text(self):
+        return ''.join(self._parts)
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -235,13 +273,18 @@ def page1():
         birthhour = int(request.form["birthhour"])
         gender = request.form["gender"]
 
-        # 생성된 유저 식별용 이메일 (가상)
-        email = f"user_{uuid.uuid4().hex[:8]}@nomail.com"
+        # 생성된 유저 식별용 이메일 (가상, 같은 방문자·같은 생년월일시면 동일)
+        if "visitor_id" not in session:
+            session["visitor_id"] = uuid.uuid4().hex
+        email = visitor_email(session["visitor_id"], birthdate, birthhour, gender)
         name = request.form.get("name", "").strip()
         if not name:
             name = "손님"
 
-        session_token = generate_session_token(email)
+        if session.get("email") == email and "session_token" in session:
+            session_token = session["session_token"]
+        else:
+            session_token = generate_session_token(email)
         session["session_token"] = session_token
         session["email"] = email
         session["name"] = name
@@ -267,36 +310,19 @@ ZHI = earthly_branches
 
 # ---------- GPT Preview Short Prompt ----------
 # --- GPT 정밀 리포트 캐싱 유틸 -----------------
-def get_match_key(u_bd, p_bd):
-    """
-    두 사람의 생년월일·시간 문자열을 정렬한 뒤 SHA256 해시를 key 로 사용
-    (순서가 바뀌어도 동일 key)
-    """
-    raw = "|".join(sorted([u_bd, p_bd]))
-    return hashlib.sha256(raw.encode()).hexdigest()
-
-def fetch_or_generate_report(match_key, prompt):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT report FROM match_reports WHERE key=?", (match_key,))
-    row = c.fetchone()
-    if row:
-        conn.close()
-        return row[0]               # 캐시 hit
-    # --- GPT 호출 ---
-    try:
-        reply = openai.chat.completions.create(
+def get_cached_report(kind, match_id):
+    return llm_cache.get(f"match_{kind}", match_id)
+
+# 같은 궁합을 여러 명이 동시에 요청해도 GPT 호출은 한 번 (llm_cache single-flight, 워커 간 임대)
+def generate_report(kind, match_id, prompt, max_tokens=1400):
+    """캐시에 없으면 생성 후 저장 (실패하면 예외, 오류 문구는 캐시에 남기지 않는다)"""
+    def generate():
+        return openai.chat.completions.create(
             model="gpt-4-turbo",
             messages=[{"role":"user","content":prompt}],
-            max_tokens=1400, temperature=0.85
+            max_tokens=max_tokens, temperature=0.85
         ).choices[0].message.content
-    except Exception as e:
-        reply = f"⚠️ 리포트 생성 오류: {e}"
-
-    c.execute("INSERT OR IGNORE INTO match_reports (key, report) VALUES (?,?)",
-              (match_key, reply))
-    conn.commit(); conn.close()
-    return reply
+    return llm_cache.get_or_generate(f"match_{kind}", match_id, generate)
 
 def full_report_prompt(user, partner, score,
                        user_counts, partner_counts, element_summary):
@@ -355,34 +381,123 @@ def preview_prompt(score, max_el, min_el, u, p):
 2) 리포트에서 더 확인할 부분을 암시
 """
 # ---------- END ----------
+# ---------- 궁합 리포트: 점수는 로컬 계산, 미리보기·정밀 리포트는 비동기 생성 ----------
+# 리포트 종류별 (llm_cache 템플릿 match_<종류>, max_tokens)
+MATCH_REPORT_KINDS = {"preview": 300, "report": 1400}
+_report_executor = ThreadPoolExecutor(max_workers=int(os.getenv("MATCH_REPORT_WORKERS", "2")))
+# 워커 프로세스당 대기·생성 중인 리포트 상한 (넘으면 새 생성은 busy, 잠시 후 다시 요청)
+MATCH_REPORT_QUEUE = int(os.getenv("MATCH_REPORT_QUEUE", "32"))
+_reports_in_flight = {}   # "<종류>:<match_id>" → Future (끝나면 바로 제거)
+_report_errors = LRUCache("match_report_errors", 256)   # 최근 생성 실패 → 오류 문구 (한 번 알리고 삭제)
+_reports_lock = threading.Lock()
+
+def get_chart_pair_key(chart_u, chart_p):
+    """두 명식의 정수 키를 정렬해 이은 문자열 (순서가 바뀌어도 동일 key)"""
+    a, b = sorted((chart_u, chart_p))
+    return f"{a.key}-{b.key}"
+
+def parse_chart_pair_key(match_id):
+    """get_chart_pair_key 의 역변환, 형식이 틀리면 ValueError"""
+    a, b = (int(x) for x in match_id.split("-"))
+    if not (0 <= a < 60 ** 4 and 0 <= b < 60 ** 4):
+        raise ValueError(match_id)
+    return Chart.from_key(a), Chart.from_key(b)
+
+def build_match_prompts(match_id):
+    """
+    명식 쌍만으로 미리보기/정밀 리포트 프롬프트 생성
+    (이름 대신 일주를 호칭으로 써서 같은 명식 쌍이면 누구나 같은 리포트를 공유)
+    """
+    a, b = parse_chart_pair_key(match_id)
+    la, lb = f"{a.to_pillars()['day']} 일주", f"{b.to_pillars()['day']} 일주"
+    if la == lb:
+        la, lb = la + " A", lb + " B"
+    ca, cb = chart_element_counts(a), chart_element_counts(b)
+    score = match_charts(a, b)
+    lines = [f"{label}: " + ", ".join(f"{k}:{v}" for k, v in counts.items())
+             for label, counts in ((la, ca), (lb, cb))]
+    elem_sum = "\n".join(
+        f"{label}: " + re.sub(r"<[^>]+>", " ", _load_saju_analysis(chart))
+        for label, chart in ((la, a), (lb, b))
+    )
+    return {
+        "preview": preview_prompt(score, max(ca, key=ca.get), min(cb, key=cb.get), la, lb),
+        "report": full_report_prompt_v2(la, lb, score, lines[0], lines[1], elem_sum),
+    }
+
+def _report_finished(key, future):
+    error = future.exception()
+    with _reports_lock:
+        _reports_in_flight.pop(key, None)
+        if error is not None:
+            _report_errors.put(key, f"⚠️ 리포트 생성 오류: {error}")
+
+def match_report_status(match_id, start=False):
+    """
+    리포트 종류별 {'status': done/pending/error/busy/missing, 'text'}
+    start=True 이면 캐시에 없는 리포트를 백그라운드에서 생성 시작
+    (대기 중인 생성이 MATCH_REPORT_QUEUE 개를 넘으면 busy)
+    """
+    result = {}
+    prompts = None
+    for kind, max_tokens in MATCH_REPORT_KINDS.items():
+        key = f"{kind}:{match_id}"
+        cached = get_cached_report(kind, match_id)
+        if cached is not None:
+            result[kind] = {"status": "done", "text": cached}
+            continue
+        started = None
+        with _reports_lock:
+            future = _reports_in_flight.get(key)
+            error = _report_errors.get(key) if future is None else None
+            if error is not None:
+                # 생성 실패 → 오류를 한 번 알리고 다음 요청에서 재시도
+                _report_errors.discard(key)
+                result[kind] = {"status": "error", "text": error}
+                continue
+            if future is None and start:
+                if len(_reports_in_flight) >= MATCH_REPORT_QUEUE:
+                    result[kind] = {"status": "busy", "text": None}
+                    continue
+                if prompts is None:
+                    prompts = build_match_prompts(match_id)
+                future = started = _report_executor.submit(generate_report, kind, match_id,
+                                                           prompts[kind], max_tokens)
+                _reports_in_flight[key] = future
+        if started is not None:
+            # 이미 끝났으면 콜백이 바로 실행되므로 _reports_lock 밖에서 등록
+            started.add_done_callback(lambda f, key=key: _report_finished(key, f))
+        result[kind] = {"status": "pending" if future is not None else "missing", "text": None}
+    return result
+
 # ---------- 궁합 알고리즘 유틸 ----------
-from itertools import product
+
+STEM_COMPLEMENTS = {'甲':'己','乙':'庚','丙':'辛','丁':'壬','戊':'癸',
+                    '己':'甲','庚':'乙','辛':'丙','壬':'丁','癸':'戊'}
+STEM_CLASHES = {('甲','庚'),('乙','辛'),('丙','壬'),('丁','癸'),('戊','甲'),
+                ('己','乙'),('庚','丙'),('辛','丁'),('壬','戊'),('癸','己')}
+THREE_HARMONIES = [('申','子','辰'),('寅','午','戌'),('亥','卯','未')]
+SIX_HARMONIES   = {('子','丑'),('寅','亥'),('卯','戌'),('辰','酉'),
+                   ('巳','申'),('午','未')}
+SIX_CLASHES     = {('子','午'),('丑','未'),('寅','申'),
+                   ('卯','酉'),('辰','戌'),('巳','亥')}
 
 def stem_relation(a, b):
     """천간 합(1) / 충(-1) 판정"""
-    stem_complements = {'甲':'己','乙':'庚','丙':'辛','丁':'壬','戊':'癸',
-                        '己':'甲','庚':'乙','辛':'丙','壬':'丁','癸':'戊'}
-    clashes = {('甲','庚'),('乙','辛'),('丙','壬'),('丁','癸'),('戊','甲'),
-               ('己','乙'),('庚','丙'),('辛','丁'),('壬','戊'),('癸','己')}
-    if stem_complements.get(a) == b:
+    if STEM_COMPLEMENTS.get(a) == b:
         return 1
-    if (a, b) in clashes or (b, a) in clashes:
+    if (a, b) in STEM_CLASHES or (b, a) in STEM_CLASHES:
         return -1
     return 0
 
 def branch_relation(a, b):
     """지지 삼합(2)·육합(1) / 충(-2)"""
-    three_harmonies = [('申','子','辰'),('寅','午','戌'),('亥','卯','未')]
-    six_harmonies   = [('子','丑'),('寅','亥'),('卯','戌'),('辰','酉'),
-                       ('巳','申'),('午','未')]
-    six_clashes     = [('子','午'),('丑','未'),('寅','申'),
-                       ('卯','酉'),('辰','戌'),('巳','亥')]
-    for trio in three_harmonies:
+    for trio in THREE_HARMONIES:
         if a in trio and b in trio:
             return 2
-    if (a, b) in six_harmonies or (b, a) in six_harmonies:
+    if (a, b) in SIX_HARMONIES or (b, a) in SIX_HARMONIES:
         return 1
-    if (a, b) in six_clashes or (b, a) in six_clashes:
+    if (a, b) in SIX_CLASHES or (b, a) in SIX_CLASHES:
         return -2
     return 0
 
@@ -399,12 +514,13 @@ def element_synergy(count_u, count_p):
             score -= 1
     return score
 
+SPOUSE_CYCLE = {'wood': 'fire', 'fire': 'earth', 'earth': 'metal',
+                'metal': 'water', 'water': 'wood'}
+
 def spouse_star_score(day_stem, partner_pillars):
     """배우자 별(재/관) 간단 호응 점수 0‑3"""
-    cycle = {'wood': 'fire', 'fire': 'earth', 'earth': 'metal',
-             'metal': 'water', 'water': 'wood'}
     self_el, _yy = stem_to_element_yinyang(day_stem)
-    need_el = cycle.get(self_el)
+    need_el = SPOUSE_CYCLE.get(self_el)
     if not need_el:
         return 0
     score = 0
@@ -417,20 +533,250 @@ def spouse_star_score(day_stem, partner_pillars):
 def match_score(cu, cp, stems_u, stems_p, pillars_u, pillars_p):
     """최종 궁합 점수 0‑100"""
     s_elem = element_synergy(cu, cp)            # 0‑10
-    s_rel  = 0
-    for a, b in product(stems_u, stems_p):
-        s_rel += stem_relation(a, b)
-    for a, b in product([p[1] for p in pillars_u.values()],
-                        [p[1] for p in pillars_p.values()]):
-        s_rel += branch_relation(a, b)
+    s_rel  = relation_score([STEM_INDEX[a] for a in stems_u], [STEM_INDEX[b] for b in stems_p],
+                            [BRANCH_INDEX[p[1]] for p in pillars_u.values()],
+                            [BRANCH_INDEX[p[1]] for p in pillars_p.values()])
     s_sp   = spouse_star_score(stems_u[2], pillars_p) \
            + spouse_star_score(stems_p[2], pillars_u)
+    return combine_match_score(s_elem, s_rel, s_sp)
 
+def combine_match_score(s_elem, s_rel, s_sp):
     # 가중치 합산 (경험적 스케일)
     raw = s_elem * 3 + s_rel * 2 + s_sp * 3
     return max(0, min(100, 50 + raw))
+
+def relation_score(stems_u, stems_p, branches_u, branches_p):
+    """천간 4x4 + 지지 4x4 관계 점수 합 (인덱스 입력, 행렬 32회 조회)"""
+    s_rel = 0
+    for a in stems_u:
+        row = STEM_RELATION_MATRIX[a]
+        for b in stems_p:
+            s_rel += row[b]
+    for a in branches_u:
+        row = BRANCH_RELATION_MATRIX[a]
+        for b in branches_p:
+            s_rel += row[b]
+    return s_rel
+
+def chart_element_counts(chart):
+    """Chart → 오행 카운트 dict (목화토금수 순)"""
+    return _saju_analyzer.element_counts(chart)
+
+def spouse_star_score_idx(day_stem, partner_stems):
+    """spouse_star_score 의 정수 버전"""
+    row = SPOUSE_STAR_MATRIX[day_stem]
+    return min(sum(row[s] for s in partner_stems), 3)
+
+def match_charts(chart_u, chart_p):
+    """Chart 두 개로 match_score 계산 (순서 무관 쌍 캐시)"""
+    key = (chart_u, chart_p) if chart_u <= chart_p else (chart_p, chart_u)
+    return match_pair_cache.get_or_compute(key, lambda: _match_charts(*key))
+
+def _match_charts(chart_u, chart_p):
+    stems_u, stems_p = chart_u.stems, chart_p.stems
+    s_elem = element_synergy(chart_element_counts(chart_u), chart_element_counts(chart_p))
+    s_rel = relation_score(stems_u, stems_p, chart_u.branches, chart_p.branches)
+    s_sp = spouse_star_score_idx(stems_u[2], stems_p) + spouse_star_score_idx(stems_p[2], stems_u)
+    return combine_match_score(s_elem, s_rel, s_sp)
 # ---------- END 궁합 알고리즘 유틸 ----------
 
+# ---------- 궁합 일괄 계산 (numpy) ----------
+ELEMENTS_KR = ['목', '화', '토', '금', '수']
+
+def _match_arrays():
+    """관계 행렬의 numpy 버전 (처음 쓸 때 한 번 생성)"""
+    global _MATCH_ARRAYS
+    if _MATCH_ARRAYS is None:
+        import numpy as np
+        _MATCH_ARRAYS = {
+            "stem_rel": np.array(STEM_RELATION_MATRIX, dtype=np.int16),
+            "branch_rel": np.array(BRANCH_RELATION_MATRIX, dtype=np.int16),
+            "spouse": np.array(SPOUSE_STAR_MATRIX, dtype=np.int16),
+            "stem_el": np.array([ELEMENTS_KR.index(e[0]) for e in STEM_ELEMENT], dtype=np.intp),
+            "branch_el": np.array([ELEMENTS_KR.index(e[0]) for e in BRANCH_ELEMENT], dtype=np.intp),
+        }
+    return _MATCH_ARRAYS
+
+_MATCH_ARRAYS = None
+
+def chart_code_arrays(codes):
+    """
+    (n, 4) 60갑자 코드 배열 → 천간 (n,4), 지지 (n,4), 오행 카운트 (n,5)
+    """
+    import numpy as np
+    arr = _match_arrays()
+    codes = np.asarray(codes, dtype=np.intp).reshape(-1, 4)
+    stems = codes % 10
+    branches = codes % 12
+    counts = np.zeros((len(codes), len(ELEMENTS_KR)), dtype=np.int16)
+    rows = np.arange(len(codes))
+    for col in range(4):
+        np.add.at(counts, (rows, arr["stem_el"][stems[:, col]]), 1)
+        np.add.at(counts, (rows, arr["branch_el"][branches[:, col]]), 1)
+    return stems, branches, counts
+
+def match_scores_against(chart, stems, branches, counts):
+    """
+    한 명식과 여러 명식(chart_code_arrays 결과)의 match_charts 점수를 한 번에 계산
+    """
+    import numpy as np
+    arr = _match_arrays()
+    q_stems = np.array(chart.stems, dtype=np.intp)
+    q_branches = np.array(chart.branches, dtype=np.intp)
+    q_counts = np.array(list(chart_element_counts(chart).values()), dtype=np.int16)
+
+    # element_synergy: 차이 0 → +2, 1 → +1, 그 외 → -1
+    diff = np.abs(counts - q_counts)
+    s_elem = np.where(diff == 0, 2, np.where(diff == 1, 1, -1)).sum(axis=1)
+    # relation_score: 질의 쪽 행을 먼저 합쳐 두면 후보당 8회 조회
+    stem_row = arr["stem_rel"][q_stems].sum(axis=0)
+    branch_row = arr["branch_rel"][q_branches].sum(axis=0)
+    s_rel = stem_row[stems].sum(axis=1) + branch_row[branches].sum(axis=1)
+    # spouse_star_score_idx 양방향
+    s_sp = np.minimum(arr["spouse"][q_stems[2]][stems].sum(axis=1), 3) \
+         + np.minimum(arr["spouse"][:, q_stems].sum(axis=1)[stems[:, 2]], 3)
+    return np.clip(50 + s_elem * 3 + s_rel * 2 + s_sp * 3, 0, 100)
+
+def pairwise_match_scores(stems, branches, counts):
+    """
+    명식 n 개의 n x n 궁합 점수와 오행 보완 점수(element_synergy) 행렬
+    (chart_code_arrays 결과 입력, 모든 쌍을 한 번의 배열 연산으로 계산)
+    """
+    import numpy as np
+    arr = _match_arrays()
+    diff = np.abs(counts[:, None, :] - counts[None, :, :])
+    s_elem = np.where(diff == 0, 2, np.where(diff == 1, 1, -1)).sum(axis=2)
+    s_rel = arr["stem_rel"][stems[:, None, :, None], stems[None, :, None, :]].sum(axis=(2, 3)) \
+          + arr["branch_rel"][branches[:, None, :, None], branches[None, :, None, :]].sum(axis=(2, 3))
+    spouse = np.minimum(arr["spouse"][stems[:, 2][:, None, None], stems[None, :, :]].sum(axis=2), 3)
+    s_sp = spouse + spouse.T
+    return np.clip(50 + s_elem * 3 + s_rel * 2 + s_sp * 3, 0, 100), s_elem
+
+def group_match_matrix(charts):
+    """
+    여러 사람의 Chart 목록 → {'scores', 'element_synergy', 'element_counts'}
+    scores / element_synergy 는 n x n 리스트, element_counts 는 사람별 오행 카운트.
+    같은 명식은 한 번만 계산한 뒤 사람 순서대로 펼친다.
+    """
+    import numpy as np
+    uniq = {}
+    inverse = np.array([uniq.setdefault(c, len(uniq)) for c in charts], dtype=np.intp)
+    if not uniq:
+        return {"scores": [], "element_synergy": [], "element_counts": []}
+    stems, branches, counts = chart_code_arrays([c.codes for c in uniq])
+    scores, synergy = pairwise_match_scores(stems, branches, counts)
+    grid = np.ix_(inverse, inverse)
+    return {
+        "scores": scores[grid].tolist(),
+        "element_synergy": synergy[grid].tolist(),
+        "element_counts": [dict(zip(ELEMENTS_KR, counts[i].tolist())) for i in inverse],
+    }
+
+class ChartPopulation:
+    """
+    명식별로 묶은 사용자 모집단 (상위 K 궁합 검색용)
+    같은 명식의 사람은 한 번만 점수를 계산한다.
+    """
+    def __init__(self, codes, ids=None):
+        import numpy as np
+        codes = np.asarray(codes, dtype=np.int64).reshape(-1, 4)
+        keys = ((codes[:, 0] * 60 + codes[:, 1]) * 60 + codes[:, 2]) * 60 + codes[:, 3]
+        self.keys, inverse, self.counts = np.unique(keys, return_inverse=True, return_counts=True)
+        self.codes = np.stack([self.keys // 216000, self.keys // 3600 % 60,
+                               self.keys // 60 % 60, self.keys % 60], axis=1)
+        self.stems, self.branches, self.element_counts = chart_code_arrays(self.codes)
+        self.size = len(keys)
+        # 명식별 구성원 id: 정렬된 id 배열을 구간으로 나눠 둔다
+        self.ids = np.arange(self.size) if ids is None else np.asarray(ids)
+        order = np.argsort(inverse, kind="stable")
+        self._member_ids = self.ids[order]
+        self._member_starts = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_rows(cls, rows):
+        """(id, 'YYYY-MM-DD', 시) 행들 → 모집단 (날짜·시가 비었거나 잘못된 행은 건너뜀)"""
+        import numpy as np
+        ids, dates, hours = [], [], []
+        for user_id, birthdate, birthhour in rows:
+            if not birthdate or birthhour is None:
+                continue
+            try:
+                date = np.datetime64(birthdate, "D")
+                hour = int(birthhour)
+            except (TypeError, ValueError, OverflowError):
+                continue
+            # NULL·빈 문자열은 예외 없이 NaT 가 된다
+            if np.isnat(date) or not 0 <= hour <= 23:
+                continue
+            dates.append(date)
+            hours.append(hour)
+            ids.append(user_id)
+        local = np.array(dates, dtype="datetime64[D]") + np.array(hours, dtype="timedelta64[h]")
+        codes = batch_pillar_codes(local, 0)
+        return cls(np.stack([codes["year"], codes["month"], codes["day"], codes["hour"]], axis=1), ids)
+
+    @classmethod
+    def from_users_table(cls, conn):
+        rows = conn.execute("SELECT id, birthdate, birthhour FROM users").fetchall()
+        return cls.from_rows(rows)
+
+    def members(self, index):
+        return self._member_ids[self._member_starts[index]:self._member_starts[index + 1]]
+
+    def scores(self, chart):
+        """고유 명식별 궁합 점수 배열"""
+        return match_scores_against(chart, self.stems, self.branches, self.element_counts)
+
+    def member_chart_index(self, chart, member_id):
+        """member_id 가 chart 명식의 구성원이면 그 고유 명식 순번, 아니면 None"""
+        import numpy as np
+        i = int(np.searchsorted(self.keys, chart.key))
+        if i < self.size and self.keys[i] == chart.key and np.any(self.members(i) == member_id):
+            return i
+        return None
+
+    def top_k(self, chart, k=10, with_members=False, exclude_member=None):
+        """
+        점수 상위 K 개 고유 명식 (동점은 명식 키 순)
+        exclude_member: 질의한 사람의 id → 그 사람 한 명만 빼고 센다
+        (같은 명식의 다른 사람은 남고, 본인뿐이던 명식만 결과에서 빠진다)
+        """
+        import numpy as np
+        scores = self.scores(chart)
+        counts = self.counts
+        pool = np.arange(len(scores))
+        own = None if exclude_member is None else self.member_chart_index(chart, exclude_member)
+        if own is not None:
+            counts = counts.copy()
+            counts[own] -= 1
+            if counts[own] == 0:
+                pool = pool[pool != own]
+        k = min(k, len(pool))
+        if k <= 0:
+            return []
+        # 상위 K 경계 점수 이상만 추려 정렬 (전체 정렬 없이)
+        sub = scores[pool]
+        cut = np.partition(sub, len(sub) - k)[len(sub) - k]
+        cand = pool[sub >= cut]
+        cand = cand[np.lexsort((self.keys[cand], -scores[cand]))][:k]
+        result = []
+        for i in cand:
+            item = {
+                "chart": Chart.from_key(int(self.keys[i])),
+                "score": int(scores[i]),
+                "count": int(counts[i]),
+            }
+            if with_members:
+                members = self.members(i)
+                if i == own:
+                    members = members[members != exclude_member]
+                item["members"] = members.tolist()
+            result.append(item)
+        return result
+
 # ====== 사주 상세 계산 함수 및 테이블 ======
 # 오행 매핑 (중국 한자)
 element_map = {
@@ -452,18 +798,19 @@ element_map = {
 # Updated Ten God computation logic based on 십성의 음양오행 관계.
 
 # 천간을 오행/음양으로 변환
+_STEM_ELEMENT_YINYANG_MAP = {
+    '甲': ('wood', 'yang'), '乙': ('wood', 'yin'),
+    '丙': ('fire', 'yang'), '丁': ('fire', 'yin'),
+    '戊': ('earth', 'yang'), '己': ('earth', 'yin'),
+    '庚': ('metal', 'yang'), '辛': ('metal', 'yin'),
+    '壬': ('water', 'yang'), '癸': ('water', 'yin'),
+}
+
 def stem_to_element_yinyang(stem):
     """
     천간(甲, 乙, ...)을 오행(wood, fire, earth, metal, water)과 음양(yang, yin)으로 변환
     """
-    mapping = {
-        '甲': ('wood', 'yang'), '乙': ('wood', 'yin'),
-        '丙': ('fire', 'yang'), '丁': ('fire', 'yin'),
-        '戊': ('earth', 'yang'), '己': ('earth', 'yin'),
-        '庚': ('metal', 'yang'), '辛': ('metal', 'yin'),
-        '壬': ('water', 'yang'), '癸': ('water', 'yin'),
-    }
-    return mapping.get(stem, ('?', '?'))
+    return _STEM_ELEMENT_YINYANG_MAP.get(stem, ('?', '?'))
 
 # 십성 매핑: (일간 오행, 일간 음양, 비교 오행, 비교 음양) => 십성
 TEN_GOD_MAP = {
@@ -584,9 +931,11 @@ def get_ten_god(day_stem, compare_stem):
     """
     Return the Ten God (십성) between day_stem and compare_stem
     """
-    self_element, self_yin_yang = stem_to_element_yinyang(day_stem)
-    other_element, other_yin_yang = stem_to_element_yinyang(compare_stem)
-    return TEN_GOD_MAP.get((self_element, self_yin_yang, other_element, other_yin_yang), '')
+    d = STEM_INDEX.get(day_stem)
+    c = STEM_INDEX.get(compare_stem)
+    if d is None or c is None:
+        return ''
+    return TEN_GOD_MATRIX[d][c]
 
 # 십이신살 (지살, 천살, 월살, 망신, 장성, 반안, 육해, 화개 등)
 twelve_gods_table = {
@@ -636,10 +985,11 @@ reverse_twelve_gods_table = {
 }
 
 def get_my_twelve_god(zhi, day_branch):
-    for group, mapping in reverse_twelve_gods_table.items():
-        if day_branch in group:
-            return mapping.get(zhi)
-    return None
+    b = BRANCH_INDEX.get(zhi)
+    d = BRANCH_INDEX.get(day_branch)
+    if b is None or d is None:
+        return None
+    return TWELVE_GOD_MATRIX[d][b]
 
 # 십이운성 표 (일간-지지)
 twelve_stage_table = {
@@ -658,51 +1008,173 @@ twelve_stage_table = {
 
 # 십이운성 계산 함수
 def get_twelve_stage(day_gan, branch):
-    return twelve_stage_table.get(day_gan, {}).get(branch, '')
+    g = STEM_INDEX.get(day_gan)
+    b = BRANCH_INDEX.get(branch)
+    if g is None or b is None:
+        return ''
+    return TWELVE_STAGE_MATRIX[g][b]
+
+# 전체 지장간(藏干) 매핑 (전통적 사주용, 모든 지지에 대해 배열로 제공)
+hidden_gan_dict = {
+    '子': ['癸'],
+    '丑': ['己', '癸', '辛'],
+    '寅': ['甲', '丙', '戊'],
+    '卯': ['乙'],
+    '辰': ['戊', '乙', '癸'],
+    '巳': ['丙', '戊', '庚'],
+    '午': ['丁', '己'],
+    '未': ['己', '丁', '乙'],
+    '申': ['庚', '壬', '戊'],
+    '酉': ['辛'],
+    '戌': ['戊', '辛', '丁'],
+    '亥': ['壬', '甲']
+}
+
+# ====== 인덱스 행렬 (천간 0~9, 지지 0~11) ======
+# 위 표들을 import 시점에 한 번 펼쳐 두고, 조회는 행렬 읽기로 끝낸다.
+# 표를 고치면 verify_relation_matrices() 가 import 시점에 불일치를 잡아낸다.
+STEM_INDEX = {g: i for i, g in enumerate(GAN)}
+BRANCH_INDEX = {z: i for i, z in enumerate(ZHI)}
+STEM_ELEMENT = tuple(element_map[g] for g in GAN)      # 천간 → (한글 오행, 한자 오행)
+BRANCH_ELEMENT = tuple(element_map[z] for z in ZHI)    # 지지 → (한글 오행, 한자 오행)
+STEM_ELEMENT_YINYANG = tuple(stem_to_element_yinyang(g) for g in GAN)
+
+def _build_relation_matrices():
+    # 십성: TEN_GOD_MAP 의 (오행, 음양) 쌍을 천간 인덱스 칸에 뿌린다
+    stems_by_el_yy = {}
+    for i, el_yy in enumerate(STEM_ELEMENT_YINYANG):
+        stems_by_el_yy.setdefault(el_yy, []).append(i)
+    ten_god = [[''] * 10 for _ in range(10)]
+    for (se, sy, oe, oy), label in TEN_GOD_MAP.items():
+        for d in stems_by_el_yy.get((se, sy), []):
+            for c in stems_by_el_yy.get((oe, oy), []):
+                ten_god[d][c] = label
+
+    # 십이운성: 일간 × 지지
+    twelve_stage = [[''] * 12 for _ in range(10)]
+    for g, row in twelve_stage_table.items():
+        for z, label in row.items():
+            twelve_stage[STEM_INDEX[g]][BRANCH_INDEX[z]] = label
+
+    # 역방향 십이신살: 일지 × 지지
+    twelve_god = [[None] * 12 for _ in range(12)]
+    for group, mapping in reverse_twelve_gods_table.items():
+        for d in group:
+            for z, label in mapping.items():
+                twelve_god[BRANCH_INDEX[d]][BRANCH_INDEX[z]] = label
+
+    hidden_stems = tuple(tuple(STEM_INDEX[g] for g in hidden_gan_dict[z]) for z in ZHI)
+    # 지장간 십성 문자열 (get_saju_details 의 ten_god_zhi): 일간 × 지지
+    hidden_ten_god = tuple(
+        tuple(', '.join(ten_god[d][h] for h in hidden_stems[z]) for z in range(12))
+        for d in range(10)
+    )
+    return (tuple(map(tuple, ten_god)), tuple(map(tuple, twelve_stage)),
+            tuple(map(tuple, twelve_god)), hidden_stems, hidden_ten_god)
+
+(TEN_GOD_MATRIX,         # [일간][천간] → 십성
+ TWELVE_STAGE_MATRIX,    # [일간][지지] → 십이운성
+ TWELVE_GOD_MATRIX,      # [일지][지지] → 십이신살
+ HIDDEN_STEMS,           # [지지] → 지장간 천간 인덱스들
+ HIDDEN_TEN_GOD_MATRIX,  # [일간][지지] → 지장간 십성 ', ' 결합 문자열
+ ) = _build_relation_matrices()
+
+def verify_relation_matrices():
+    """행렬이 원본 표와 같은 결과를 내는지 전수 검사 (불일치 시 RuntimeError)"""
+    errors = []
+    for d, dg in enumerate(GAN):
+        se, sy = stem_to_element_yinyang(dg)
+        for c, cg in enumerate(GAN):
+            oe, oy = stem_to_element_yinyang(cg)
+            if TEN_GOD_MATRIX[d][c] != TEN_GOD_MAP.get((se, sy, oe, oy), ''):
+                errors.append(f"십성 {dg}{cg}")
+        for z, zg in enumerate(ZHI):
+            if TWELVE_STAGE_MATRIX[d][z] != twelve_stage_table.get(dg, {}).get(zg, ''):
+                errors.append(f"십이운성 {dg}{zg}")
+            hidden = [TEN_GOD_MAP.get((se, sy) + stem_to_element_yinyang(h), '')
+                      for h in hidden_gan_dict.get(zg, [])]
+            if HIDDEN_TEN_GOD_MATRIX[d][z] != ', '.join(hidden):
+                errors.append(f"지장간 십성 {dg}{zg}")
+    for d, dz in enumerate(ZHI):
+        mapping = next((m for group, m in reverse_twelve_gods_table.items() if dz in group), {})
+        for z, zg in enumerate(ZHI):
+            if TWELVE_GOD_MATRIX[d][z] != mapping.get(zg):
+                errors.append(f"십이신살 {dz}{zg}")
+        if [GAN[h] for h in HIDDEN_STEMS[d]] != hidden_gan_dict.get(dz, []):
+            errors.append(f"지장간 {dz}")
+    if errors:
+        raise RuntimeError("관계 행렬이 원본 표와 다릅니다: " + ", ".join(errors[:10]))
+
+verify_relation_matrices()
+
+def get_ten_god_idx(day_stem, compare_stem):
+    """get_ten_god 의 정수 버전 (천간 인덱스)"""
+    return TEN_GOD_MATRIX[day_stem][compare_stem]
+
+def get_twelve_stage_idx(day_stem, branch):
+    """get_twelve_stage 의 정수 버전"""
+    return TWELVE_STAGE_MATRIX[day_stem][branch]
+
+def get_my_twelve_god_idx(branch, day_branch):
+    """get_my_twelve_god 의 정수 버전"""
+    return TWELVE_GOD_MATRIX[day_branch][branch]
+
+# 궁합 관계 행렬: 문자열 판정 함수를 모든 쌍에 대해 한 번씩만 돌려 둔다
+STEM_RELATION_MATRIX = tuple(tuple(stem_relation(a, b) for b in GAN) for a in GAN)
+BRANCH_RELATION_MATRIX = tuple(tuple(branch_relation(a, b) for b in ZHI) for a in ZHI)
+# [일간][상대 천간] → 배우자 별 1점 여부 (spouse_star_score 를 기둥 하나로 평가)
+SPOUSE_STAR_MATRIX = tuple(tuple(spouse_star_score(a, {'p': b + ZHI[0]}) for b in GAN) for a in GAN)
+
+MATCH_CACHE_SIZE = int(os.getenv("MATCH_CACHE_SIZE", "100000"))
+match_pair_cache = LRUCache("match_pairs", MATCH_CACHE_SIZE)
+
+# 명식(Chart)별 결과 캐시: 입력 조합이 유한하므로 요청마다 다시 계산하지 않는다
+SAJU_CACHE_SIZE = int(os.getenv("SAJU_CACHE_SIZE", "50000"))
+saju_details_cache = LRUCache("saju_details", SAJU_CACHE_SIZE)
+saju_analyzer_cache = LRUCache("saju_analyzer", SAJU_CACHE_SIZE)
 
 # 사주 각 기둥에 대한 세부 정보 정리
 def get_saju_details(pillars):
-    day_gan = pillars['day'][0]  # 일간 기준
+    """
+    pillars: {'year': '甲子', ...} dict 또는 Chart
+    결과는 명식별로 캐시되며 읽기 전용(MappingProxyType)으로 반환된다.
+    """
+    chart = pillars if isinstance(pillars, Chart) else Chart.from_pillars(pillars)
+    return saju_details_cache.get_or_compute(chart, lambda: freeze(_load_saju_details(chart)))
+
+def _load_saju_details(chart):
+    # 사전 계산 저장소에 있으면 그대로 쓰고, 없으면 (야자시 등) 직접 계산
+    record = chart_store.get(chart) if chart_store is not None else None
+    if record is not None:
+        return record["details"]
+    return _compute_saju_details(chart)
+
+def _compute_saju_details(chart):
+    day_gan = chart.day_stem  # 일간 기준
+    day_zhi = chart.day_branch
     saju_info = {}
 
-    # 전체 지장간(藏干) 매핑 (전통적 사주용, 모든 지지에 대해 배열로 제공)
-    hidden_gan_dict = {
-        '子': ['癸'],
-        '丑': ['己', '癸', '辛'],
-        '寅': ['甲', '丙', '戊'],
-        '卯': ['乙'],
-        '辰': ['戊', '乙', '癸'],
-        '巳': ['丙', '戊', '庚'],
-        '午': ['丁', '己'],
-        '未': ['己', '丁', '乙'],
-        '申': ['庚', '壬', '戊'],
-        '酉': ['辛'],
-        '戌': ['戊', '辛', '丁'],
-        '亥': ['壬', '甲']
-    }
-
-    for pillar_name in ['year', 'month', 'day', 'hour']:
-        gan = pillars[pillar_name][0]
-        zhi = pillars[pillar_name][1]
-        el_gan, yin_gan = element_map.get(gan, ('?', '?'))  # 한글 간지용
-        el_zhi, yin_zhi = element_map.get(zhi, ('?', '?'))
+    for pillar_name, code in zip(['year', 'month', 'day', 'hour'], chart.codes):
+        gan = code % 10
+        zhi = code % 12
+        el_gan, yin_gan = STEM_ELEMENT[gan]  # 한글 간지용
+        el_zhi, yin_zhi = BRANCH_ELEMENT[zhi]
         # 십성(ten_god) 계산을 모든 천간에 대해, 일간 기준으로 수행 (음양오행 기반)
-        ten_god = get_ten_god(day_gan, gan)
+        ten_god = TEN_GOD_MATRIX[day_gan][gan]
         # 지지의 모든 지장간(藏干)으로 십성 계산 (음양오행 기반)
-        hidden_gans = hidden_gan_dict.get(zhi, [])
-        ten_god_zhi = [get_ten_god(day_gan, hg) for hg in hidden_gans]
-        twelve_stage = get_twelve_stage(day_gan, zhi)
-        twelve_god = get_my_twelve_god(zhi, pillars['day'][1])
+        ten_god_zhi = HIDDEN_TEN_GOD_MATRIX[day_gan][zhi]
+        twelve_stage = TWELVE_STAGE_MATRIX[day_gan][zhi]
+        twelve_god = TWELVE_GOD_MATRIX[day_zhi][zhi]
 
         saju_info[pillar_name] = {
-            'gan': gan,
-            'zhi': zhi,
+            'gan': GAN[gan],
+            'zhi': ZHI[zhi],
             'element_gan': el_gan,
             'yin_gan': yin_gan,
             'element_zhi': el_zhi,
             'yin_zhi': yin_zhi,
             'ten_god': ten_god,
-            'ten_god_zhi': ', '.join(ten_god_zhi),
+            'ten_god_zhi': ten_god_zhi,
             'twelve_stage': twelve_stage,
             'twelve_god': twelve_god
         }
@@ -715,6 +1187,9 @@ class SajuAnalyzer:
     """
     간단한 사주 분석 클래스 (예시 버전)
     """
+    # 해석 문구를 바꾸면 올려서 명식 저장소를 다시 빌드하게 한다
+    VERSION = 1
+
     def __init__(self):
         # 오행 매핑
         self.element_map = {
@@ -737,18 +1212,21 @@ class SajuAnalyzer:
         네 기둥(연, 월, 일, 시)의 간지(예: '甲子')를 입력받아
         오행 분포와 간단한 해석을 반환합니다.
         """
-        # 각 기둥에서 천간과 지지 추출
-        pillars = [year_pillar, month_pillar, day_pillar, time_pillar]
-        chars = []
-        for p in pillars:
-            if len(p) == 2:
-                chars.extend([p[0], p[1]])
-        # 오행 카운트
+        chart = Chart.from_pillars([year_pillar, month_pillar, day_pillar, time_pillar])
+        return self.analyze_chart(chart)
+
+    def element_counts(self, chart):
+        """Chart 의 천간·지지 8글자 오행 카운트"""
         counts = {el: 0 for el in self.elements_kr}
-        for ch in chars:
-            el = self.element_map.get(ch)
-            if el:
-                counts[el] += 1
+        for code in chart.codes:
+            counts[STEM_ELEMENT[code % 10][0]] += 1
+            counts[BRANCH_ELEMENT[code % 12][0]] += 1
+        return counts
+
+    def analyze_chart(self, chart):
+        """analyze_saju 의 Chart 버전"""
+        # 오행 카운트
+        counts = self.element_counts(chart)
         # 간단한 해석
         max_el = max(counts, key=lambda k: counts[k])
         min_el = min(counts, key=lambda k: counts[k])
@@ -762,29 +1240,29 @@ class SajuAnalyzer:
         else:
             analysis += "<br>오행의 균형이 비교적 잘 잡혀 있습니다."
 
-        # 추가: 십성 계산
-        ten_gods = []
-        day_gan = day_pillar[0]
-        for label, pillar in zip(['년간', '월간', '일간', '시간'], [year_pillar, month_pillar, day_pillar, time_pillar]):
-            tg = get_ten_god(day_gan, pillar[0])
-            ten_gods.append(f"- {label} {pillar[0]}: {tg}")
-        for label, pillar in zip(['년지', '월지', '일지', '시지'], [year_pillar, month_pillar, day_pillar, time_pillar]):
-            zhi = pillar[1]
-            main_hidden_gan = {
-                '子': '癸', '丑': '己', '寅': '甲', '卯': '乙', '辰': '戊', '巳': '丙',
-                '午': '丁', '未': '己', '申': '庚', '酉': '辛', '戌': '戊', '亥': '壬'
-            }
-            hidden_g = main_hidden_gan.get(zhi)
-            if hidden_g:
-                tg = get_ten_god(day_gan, hidden_g)
-                ten_gods.append(f"- {label} {zhi}: {tg}")
-
         return analysis
 
 # Analyze saju using SajuAnalyzer class
 def analyze_saju_by_saju_analyzer(year_pillar, month_pillar, day_pillar, time_pillar):
-    analyzer = SajuAnalyzer()
-    return analyzer.analyze_saju(year_pillar, month_pillar, day_pillar, time_pillar)
+    chart = Chart.from_pillars([year_pillar, month_pillar, day_pillar, time_pillar])
+    return saju_analyzer_cache.get_or_compute(chart, lambda: _load_saju_analysis(chart))
+
+def _load_saju_analysis(chart):
+    record = chart_store.get(chart) if chart_store is not None else None
+    if record is not None:
+        return record["summary"]
+    return _saju_analyzer.analyze_chart(chart)
+
+_saju_analyzer = SajuAnalyzer()
+
+def saju_rules_digest():
+    """명식 저장소 호환성 확인용: 사주 표와 해석 규칙 버전의 해시"""
+    raw = repr((STEM_ELEMENT, BRANCH_ELEMENT, TEN_GOD_MATRIX, TWELVE_STAGE_MATRIX,
+                TWELVE_GOD_MATRIX, HIDDEN_TEN_GOD_MATRIX, SajuAnalyzer.VERSION))
+    return hashlib.sha256(raw.encode()).digest()
+
+# 전체 명식 사전 계산 저장소 (python chart_store.py 로 빌드, 없으면 직접 계산)
+chart_store = load_store(expected_digest=saju_rules_digest())
 
 # GPT 운세 생성 함수 (기본)
 def generate_fortune(birthdate, birth_hour):
@@ -792,26 +1270,78 @@ def generate_fortune(birthdate, birth_hour):
     year_ganji = GAN[(year - 4) % 10] + ZHI[(year - 4) % 12]
     hour_branch = get_hour_branch(birth_hour)
 
+    # 프롬프트는 연간지·시지·날짜로만 정해지므로 같은 날 같은 조합은 한 번만 생성
+    # (보통은 전날 밤 flask --app main pregenerate-fortunes 로 미리 만들어 둔다)
+    try:
+        return llm_cache.get_or_generate("daily_fortune", year_ganji + hour_branch,
+                                         lambda: generate_daily_fortune_text(year_ganji, hour_branch))
+    except Exception as e:
+        return f"⚠️ 오류 발생: {e}"
+
+def generate_daily_fortune_text(year_ganji, hour_branch):
+    """오늘의 운세 GPT 호출 (실패 시 예외)"""
     prompt = f"""
 당신은 사주 해석 전문가입니다.
 아래 사용자의 연간지: {year_ganji}, 시지: {hour_branch}를 바탕으로
 오늘의 전반적인 운세를 300자 이내로 자연스럽게 설명해주세요.
     """
-
+    response = openai.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": "당신은 정확한 사주 운세 전문가입니다."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.8,
+        max_tokens=600
+    )
+    reply = response.choices[0].message.content
+    return format_fortune_text(reply)
+
+def daily_fortune_classes():
+    """오늘의 운세 입력 조합 전체: 연간지 60 x 시지 12 = 720"""
+    return [(GANZHI[i], branch) for i in range(60) for branch in earthly_branches]
+
+# 다음 날 오늘의 운세 사전 생성 (cron 예: 0 1 * * * flask --app main pregenerate-fortunes)
+@app.cli.command("pregenerate-fortunes")
+@click.option("--date", "date_str", default=None, help="생성할 날짜 YYYY-MM-DD (기본: 내일)")
+@click.option("--concurrency", default=4, show_default=True, help="동시 호출 수")
+@click.option("--rate", default=1.0, show_default=True, help="초당 최대 호출 수")
+@click.option("--retries", default=3, show_default=True)
+@click.option("--force", is_flag=True, help="이미 캐시에 있어도 다시 생성")
+def pregenerate_fortunes_command(date_str, concurrency, rate, retries, force):
+    target = (datetime.strptime(date_str, "%Y-%m-%d") if date_str
+              else datetime.now() + timedelta(days=1))
+    classes = daily_fortune_classes()
+    todo = [c for c in classes
+            if force or llm_cache.get("daily_fortune", c[0] + c[1], now=target) is None]
+    print(f"{target:%Y-%m-%d} 오늘의 운세: {len(classes)}개 중 {len(todo)}개 생성")
+
+    def generate(item):
+        year_ganji, hour_branch = item
+        llm_cache.put("daily_fortune", year_ganji + hour_branch,
+                      generate_daily_fortune_text(year_ganji, hour_branch), now=target)
+
+    result = run_batch(todo, generate, concurrency=concurrency, retries=retries,
+                       limiter=RateLimiter(rate, burst=concurrency))
+    print(f"완료 {result['succeeded']}개, 실패 {len(result['failed'])}개, "
+          f"호출 {result['attempts']}회, {result['elapsed']}초")
+    for (year_ganji, hour_branch), error in result["failed"]:
+        print(f"  ❌ {year_ganji}/{hour_branch}: {error}")
+    if result["failed"]:
+        sys.exit(1)
+
+# 오늘의 운세 (page2 의 loadFortune('today')): 전날 밤 pregenerate-fortunes 로 채운
+# llm_cache 에서 읽고, 없을 때만 그 자리에서 생성 (같은 조합은 single-flight 로 한 번)
+@app.route("/api/fortune/today")
+def api_fortune_today():
+    if "session_token" not in session:
+        return {"error": "unauthorized"}, 401
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "당신은 정확한 사주 운세 전문가입니다."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.8,
-            max_tokens=600
-        )
-        reply = response.choices[0].message.content
-        return format_fortune_text(reply)
-    except Exception as e:
-        return f"⚠️ 오류 발생: {e}"
+        birthdate = datetime.strptime(session.get("birthdate"), "%Y-%m-%d")
+        birth_hour = int(session.get("birthhour", 12))
+    except (TypeError, ValueError):
+        return {"error": "invalid birthdate"}, 400
+    return {"menu_title": "오늘의 운세 🌟", "fortune_result": generate_fortune(birthdate, birth_hour)}
 
 # GPT 사주팔자 해석 함수
 def generate_saju_analysis(birthdate, birth_hour):
@@ -846,7 +1376,7 @@ def generate_saju_analysis(birthdate, birth_hour):
 전문가의 조언처럼 신뢰감 있게 작성해주세요.
 """
 
-    try:
+    def generate():
         response = openai.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
@@ -858,23 +1388,15 @@ def generate_saju_analysis(birthdate, birth_hour):
         )
         reply = response.choices[0].message.content
         return format_fortune_text(reply)
+
+    try:
+        return llm_cache.get_or_generate("saju_summary", year_ganji + hour_branch, generate)
     except Exception as e:
         return f"⚠️ 오류 발생: {e}"
 
 def get_ilju_interpretation(ilju):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT cn, kr, en FROM saju_interpretations WHERE ilju = ?", (ilju,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        # Apply newline-to-<br> conversion to explanations
-        cn = row[0].replace('\n', '<br>') if row[0] else None
-        kr = row[1].replace('\n', '<br>') if row[1] else None
-        en = row[2].replace('\n', '<br>') if row[2] else None
-        return {"cn": cn, "kr": kr, "en": en}
-    else:
-        return {"cn": None, "kr": None, "en": None}
+    # 참조 데이터에서 조회 (<br> 변환은 로드 시 완료, 읽기 전용 mapping)
+    return reference_data().ilju.get(ilju, EMPTY_ILJU)
 
 # route: PAGE 2
 @app.route("/page2")
@@ -892,22 +1414,6 @@ def page2():
     except:
         birthdate = datetime.now()
 
-    # Generate or retrieve today’s fortune
-    # cached = get_fortune_from_db(email, "basic")
-    # if cached:
-    #     today_fortune = cached
-    # else:
-    #     today_fortune = generate_fortune(birthdate, birth_hour)
-    #     save_fortune_to_db(email, "basic", today_fortune)
-
-    # Generate saju analysis with caching
-    # cached_saju = get_fortune_from_db(email, "saju")
-    # if cached_saju:
-    #     saju_analysis = cached_saju
-    # else:
-    #     saju_analysis = generate_saju_analysis(birthdate, birth_hour)
-    #     save_fortune_to_db(email, "saju", saju_analysis)
-
     # 일주 계산 및 해석 추가
     pillars = calculate_four_pillars(datetime(birthdate.year, birthdate.month, birthdate.day, birth_hour))
     saju_info = get_saju_details(pillars)
@@ -920,12 +1426,12 @@ def page2():
 
     # 추가: 三命通会 원문 해석 가져오기
     print("🔎 section_key:", normalize_section_key(pillars["day"], pillars["hour"]))
-    ctext_rows = get_ctext_match(pillars["day"], pillars["hour"])
+    ctext_entry = reference_data().ctext.get((pillars["day"], pillars["hour"]))
     ctext_explanation = None
     ctext_kr_literal = None
-    if ctext_rows:
-        ctext_explanation = "\n\n".join([row["content"] for row in ctext_rows])
-        ctext_kr_literal = "\n\n".join([row["kr_literal"] for row in ctext_rows if row["kr_literal"]])
+    if ctext_entry:
+        ctext_explanation = ctext_entry.explanation
+        ctext_kr_literal = ctext_entry.kr_literal
 
     return render_template(
         "page2.html",
@@ -943,25 +1449,15 @@ def page2():
     )
 
 
-@app.route("/api/saju_ai_analysis", methods=["POST"])
-def api_saju_ai_analysis():
-    if "session_token" not in session:
-        return {"error": "unauthorized"}, 401
-
-    # Check for cached analysis in session
-    if "cached_saju_analysis" in session:
-        return {"result": session["cached_saju_analysis"]}
-
-    birthdate_str = session.get("birthdate")
-    birth_hour = int(session.get("birthhour", 12))
-
-    try:
-        birthdate = datetime.strptime(birthdate_str, "%Y-%m-%d")
-    except:
-        return {"error": "invalid birthdate"}, 400
+def session_chart():
+    """세션의 생년월일시 → Chart (생년월일이 잘못되면 ValueError)"""
+    birthdate = datetime.strptime(session.get("birthdate"), "%Y-%m-%d")
+    return calculate_chart(datetime(birthdate.year, birthdate.month, birthdate.day,
+                                    int(session.get("birthhour", 12))))
 
-    pillars = calculate_four_pillars(datetime(birthdate.year, birthdate.month, birthdate.day, birth_hour))
-    saju_info = get_saju_details(pillars)
+def build_saju_analysis_prompt(chart):
+    """명식 → GPT 통합 해석 프롬프트 (명식에만 의존하므로 결과를 명식 키로 공유)"""
+    pillars = chart.to_pillars()
 
     # 원문 해석과 일주 해석 병합
     ilju = pillars["day"]
@@ -977,7 +1473,7 @@ def api_saju_ai_analysis():
     )
 
     # GPT에게 전달할 통합 프롬프트 구성
-    prompt = f"""
+    return f"""
 당신은 사주 해석 전문가입니다.
 다음은 한 사람의 사주 정보입니다:
 
@@ -989,24 +1485,286 @@ def api_saju_ai_analysis():
 이 정보를 종합하여, 이 사람의 인생 전반적 특성과 강점, 유의사항을 300자 내외로 종합 해석해주세요.
 """
 
+def saju_analysis_messages(prompt):
+    return [
+        {"role": "system", "content": "당신은 전문 사주 해석가입니다."},
+        {"role": "user", "content": prompt}
+    ]
+
+@app.route("/api/saju_ai_analysis", methods=["POST"])
+def api_saju_ai_analysis():
+    if "session_token" not in session:
+        return {"error": "unauthorized"}, 401
+
     try:
+        chart = session_chart()
+    except (TypeError, ValueError):
+        return {"error": "invalid birthdate"}, 400
+
+    # 같은 명식의 해석은 모든 방문자가 공유 (llm_cache)
+    cached = llm_cache.get("saju_analysis", chart.key)
+    if cached is not None:
+        return {"result": cached}
+
+    # GPT 호출은 백그라운드 작업으로 (요청 워커는 바로 반환, /api/jobs/<id> 로 결과 조회)
+    try:
+        job_id = llm_jobs.submit("saju_analysis", session["session_token"], run_saju_analysis,
+                                 build_saju_analysis_prompt(chart), chart.key)
+    except QueueFull:
+        return {"error": "요청이 많아 잠시 후 다시 시도해주세요."}, 503
+    return {"job_id": job_id, "status": "pending"}, 202
+
+def run_saju_analysis(prompt, chart_key):
+    def generate():
         response = openai.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "당신은 전문 사주 해석가입니다."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=saju_analysis_messages(prompt),
             temperature=0.8,
             max_tokens=600
         )
-        reply = format_fortune_text(response.choices[0].message.content)
-        # Cache the result in session
-        session["cached_saju_analysis"] = reply
-        return {"result": reply}
+        return format_fortune_text(response.choices[0].message.content)
+    return llm_cache.get_or_generate("saju_analysis", chart_key, generate)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# 스트리밍 변형: 토큰이 오는 대로 문장 단위로 서식을 입혀 SSE 로 보낸다
+# (완성된 결과는 비스트리밍 경로와 같은 llm_cache 에 저장, 생성은 키마다 한 번)
+@app.route("/api/saju_ai_analysis/stream")
+def api_saju_ai_analysis_stream():
+    if "session_token" not in session:
+        return {"error": "unauthorized"}, 401
+    try:
+        chart = session_chart()
+    except (TypeError, ValueError):
+        return {"error": "invalid birthdate"}, 400
+    cached = llm_cache.get("saju_analysis", chart.key)
+    if cached is not None:
+        return Response(sse_event("done", {"result": cached}), mimetype="text/event-stream")
+    prompt = build_saju_analysis_prompt(chart)
+
+    def generate():
+        # 연결 직후 바로 한 줄 보내 첫 바이트 시간을 줄인다
+        yield ": started\n\n"
+        try:
+            # 같은 명식을 이미 다른 요청(스레드·워커)이 생성 중이면 그 결과를 기다려 done 하나로 보낸다
+            with llm_cache.generation("saju_analysis", chart.key) as slot:
+                if slot.value is None:
+                    formatter = FortuneTextStream()
+                    stream = openai.chat.completions.create(
+                        model="gpt-3.5-turbo",
+                        messages=saju_analysis_messages(prompt),
+                        temperature=0.8,
+                        max_tokens=600,
+                        stream=True
+                    )
+                    for chunk in stream:
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        html = formatter.feed(delta or "")
+                        if html:
+                            yield sse_event("chunk", {"html": html})
+                    html = formatter.finish()
+                    if html:
+                        yield sse_event("chunk", {"html": html})
+                    slot.value = formatter.text
+        except Exception as e:
+            yield sse_event("failed", {"error": str(e)})
+            return
+        yield sse_event("done", {"result": slot.value})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# 백그라운드 작업 상태 조회 (?wait=초 를 주면 그동안 끝나기를 기다림)
+JOB_WAIT_MAX = 10
+
+@app.route("/api/jobs/<job_id>")
+def api_job_status(job_id):
+    if "session_token" not in session:
+        return {"error": "unauthorized"}, 401
+    try:
+        wait = max(0.0, min(float(request.args.get("wait", 0)), JOB_WAIT_MAX))
+    except ValueError:
+        return {"error": "invalid wait"}, 400
+    job = llm_jobs.wait(job_id, wait) if wait else llm_jobs.get(job_id)
+    if job is None or job["owner"] != session["session_token"]:
+        return {"error": "not found"}, 404
+    if job["status"] == "done":
+        return {"job_id": job_id, "status": "done", "result": job["result"]}
+    if job["status"] == "error":
+        return {"job_id": job_id, "status": "error", "error": job["error"]}, 500
+    return {"job_id": job_id, "status": job["status"]}, 202
+
+
+
+# 상위 K 궁합: users 테이블 모집단은 워커마다 주기적으로 다시 읽는다
+# 다시 읽기는 백그라운드 스레드가 하고 끝나면 교체 (요청은 기존 스냅샷으로 바로 응답)
+MATCH_POPULATION_TTL = int(os.getenv("MATCH_POPULATION_TTL", "600"))
+_population = {"built": 0.0, "value": None, "building": False}
+_population_lock = threading.Lock()
+_population_ready = threading.Event()
+
+def _rebuild_user_population():
+    try:
+        value = ChartPopulation.from_users_table(user_db.connection())
     except Exception as e:
-        return {"error": str(e)}, 500
+        print(f"⚠️ 궁합 모집단 다시 읽기 실패, 기존 모집단 유지: {e}")
+        value = None
+    with _population_lock:
+        if value is not None:
+            _population["value"] = value
+        _population["built"] = time.time()
+        _population["building"] = False
+    _population_ready.set()
+
+def get_user_population(timeout=30):
+    """현재 모집단 스냅샷 (아직 한 번도 못 읽었으면 None)"""
+    with _population_lock:
+        value = _population["value"]
+        start = (not _population["building"]
+                 and (value is None or time.time() - _population["built"] > MATCH_POPULATION_TTL))
+        if start:
+            _population["building"] = True
+    if start:
+        threading.Thread(target=_rebuild_user_population, name="match-population", daemon=True).start()
+    if value is None:
+        # 워커의 첫 요청만 처음 읽기가 끝나기를 기다린다
+        _population_ready.wait(timeout)
+        value = _population["value"]
+    return value
+
+@app.route("/api/match/top")
+def api_match_top():
+    if "session_token" not in session:
+        return {"error": "unauthorized"}, 401
+    try:
+        birthdate = datetime.strptime(session.get("birthdate"), "%Y-%m-%d")
+        k = max(1, min(int(request.args.get("k", 10)), 50))
+    except (TypeError, ValueError):
+        return {"error": "invalid request"}, 400
+    chart = calculate_chart(datetime(birthdate.year, birthdate.month, birthdate.day,
+                                     int(session.get("birthhour", 12))))
+    population = get_user_population()
+    if population is None:
+        return {"error": "잠시 후 다시 시도해주세요."}, 503
+    # 모집단에 본인이 들어 있으면 본인 한 명은 개수에서 뺀다 (같은 명식의 다른 사람은 그대로)
+    row = user_db.execute("SELECT id FROM users WHERE email = ? AND session_token = ?",
+                          (session.get("email"), session["session_token"])).fetchone()
+    return {
+        "population": len(population),
+        "matches": [
+            {"pillars": m["chart"].to_pillars(), "score": m["score"], "count": m["count"]}
+            for m in population.top_k(chart, k, exclude_member=row[0] if row else None)
+        ],
+    }
 
 
+def parse_person_chart(person):
+    """{'birthdate': 'YYYY-MM-DD', 'birthhour': 0~23} → Chart, 잘못되면 ValueError"""
+    try:
+        birthdate = datetime.strptime(person["birthdate"], "%Y-%m-%d")
+        hour = int(person.get("birthhour", 12))
+    except (KeyError, TypeError, AttributeError, ValueError):
+        raise ValueError(f"잘못된 생년월일/시: {person}") from None
+    if not 0 <= hour <= 23:
+        raise ValueError(f"잘못된 생년월일/시: {person}")
+    return calculate_chart(birthdate.replace(hour=hour))
+
+# 궁합: 점수·오행 분석은 바로 응답하고, GPT 리포트는 백그라운드 생성 후 폴링
+@app.route("/api/match", methods=["POST"])
+def api_match():
+    # 리포트 생성(GPT 호출 2회)을 시작하므로 세션이 있어야 한다
+    if "session_token" not in session:
+        return {"error": "unauthorized"}, 401
+    data = request.get_json(silent=True) or {}
+    try:
+        chart_u = parse_person_chart(data.get("user"))
+        chart_p = parse_person_chart(data.get("partner"))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    match_id = get_chart_pair_key(chart_u, chart_p)
+    counts_u, counts_p = chart_element_counts(chart_u), chart_element_counts(chart_p)
+    return {
+        "match_id": match_id,
+        "score": match_charts(chart_u, chart_p),
+        "pillars": {"user": chart_u.to_pillars(), "partner": chart_p.to_pillars()},
+        "element_counts": {"user": counts_u, "partner": counts_p},
+        "element_synergy": element_synergy(counts_u, counts_p),
+        "reports": match_report_status(match_id, start=True),
+    }
+
+@app.route("/api/match/<match_id>/reports")
+def api_match_reports(match_id):
+    try:
+        parse_chart_pair_key(match_id)
+    except ValueError:
+        return {"error": "invalid match id"}, 400
+    return {"match_id": match_id, "reports": match_report_status(match_id)}
+
+# 단체 궁합: 가족·팀 등 여러 사람의 궁합 점수 행렬
+GROUP_MATCH_MAX = int(os.getenv("GROUP_MATCH_MAX", "200"))
+
+@app.route("/api/match/group", methods=["POST"])
+def api_match_group():
+    data = request.get_json(silent=True) or {}
+    people = data.get("people")
+    if not isinstance(people, list) or not people:
+        return {"error": "people 목록이 필요합니다"}, 400
+    if len(people) > GROUP_MATCH_MAX:
+        return {"error": f"최대 {GROUP_MATCH_MAX}명까지 가능합니다"}, 400
+    try:
+        charts = [parse_person_chart(person) for person in people]
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    result = group_match_matrix(charts)
+    return {
+        "people": [
+            {"name": person.get("name", ""), "pillars": chart.to_pillars(), "element_counts": counts}
+            for person, chart, counts in zip(people, charts, result["element_counts"])
+        ],
+        "scores": result["scores"],
+        "element_synergy": result["element_synergy"],
+    }
+
+
+# 三命通会 원문 전문 검색 (FTS5, bm25 순위 + 스니펫)
+@app.route("/api/ctext/search")
+def api_ctext_search():
+    q = request.args.get("q", "").strip()
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+        per_page = max(1, min(int(request.args.get("per_page", 20)), 100))
+    except ValueError:
+        return {"error": "invalid page"}, 400
+    if not q:
+        return {"error": "q 가 필요합니다"}, 400
+    try:
+        conn = connect_readonly(CTEXT_DB_NAME)
+        try:
+            total, results = search_ctext(conn, q, page, per_page)
+        finally:
+            conn.close()
+    except sqlite3.OperationalError as e:
+        # ctext.db 가 없거나 init-db 로 색인을 만들기 전
+        print(f"⚠️ 원문 검색 실패: {e}")
+        return {"error": "원문 검색을 사용할 수 없습니다. 잠시 후 다시 시도해주세요."}, 503
+    return {"query": q, "page": page, "per_page": per_page, "total": total, "results": results}
+
+
+# 모니터링: 프로세스 내 캐시 적중/미스/축출 통계, 참조 데이터 스냅샷 버전,
+# DB 연결 통계, 방문 기록 큐 깊이, LLM 작업 큐, LLM 캐시 템플릿별 적중률
+@app.route("/api/stats")
+def api_stats():
+    return {
+        "caches": all_cache_stats(),
+        "reference_data": reference_data_stats(),
+        "db": user_db.stats(),
+        "visits": visit_writer.stats(),
+        "llm_jobs": llm_jobs.stats(),
+        "llm_cache": llm_cache.stats(),
+    }
+
 
 # 로그인 라우트 추가
 @app.route("/login", methods=["GET", "POST"])
@@ -1017,12 +1775,8 @@ def login():
         password = request.form["password"]
         hashed_pw = hashlib.sha256(password.encode()).hexdigest()
 
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        c.execute("CREATE TABLE IF NOT EXISTS accounts (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE, password TEXT)")
-        c.execute("SELECT email FROM accounts WHERE email=? AND password=?", (email, hashed_pw))
-        row = c.fetchone()
-        conn.close()
+        row = user_db.execute("SELECT email FROM accounts WHERE email=? AND password=?",
+                              (email, hashed_pw)).fetchone()
 
         if row:
             session["username"] = email
@@ -1076,18 +1830,15 @@ def signup():
         hashed_pw = hashlib.sha256(password.encode()).hexdigest()
 
         # DB에 사용자 저장
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        c.execute("CREATE TABLE IF NOT EXISTS accounts (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE, password TEXT)")
         try:
-            c.execute("INSERT INTO accounts (email, password) VALUES (?, ?)", (email, hashed_pw))
-            conn.commit()
+            with user_db.transaction() as conn:
+                conn.execute("INSERT INTO accounts (email, password) VALUES (?, ?)", (email, hashed_pw))
         except sqlite3.IntegrityError:
-            conn.close()
             return render_template("signup.html", error="이미 가입된 이메일입니다.")
-        conn.close()
         return redirect("/login")
     return render_template("signup.html")
 
 if __name__ == "__main__":
+    init_db()
+    reload_reference_data(force=True)
     app.run(debug=True)
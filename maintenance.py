@@ -0,0 +1,198 @@
+# maintenance.py
+"""
+쓰기 DB 보존 정책 (cron 등에서 주기적으로 실행)
+
+user_fortunes 는 예전 유저·메뉴·날짜별 하루치 결과다 (지금은 쓰지 않고, 오늘의 운세는
+llm_cache 의 daily_fortune 으로 공유). 남은 행 중 보존 기간이 지난 행을 batch_size 단위로 지우고(짧은 트랜잭션으로 나눠 요청을 오래 막지 않음),
+archive 경로를 주면 지우기 전에 그 파일의 같은 이름 테이블로 옮긴다.
+llm_jobs(백그라운드 LLM 작업, 결과 전문 포함)는 결과를 몇 분 안에 가져가므로
+JOB_RETENTION_HOURS 가 지난 행을 같은 방식으로 지운다.
+llm_cache 의 날짜 구간 템플릿(daily_fortune 등)은 키에 날짜가 들어가 오늘이 지나면 다시 읽히지 않으므로
+지난 날짜·예전 버전 행을 크기 축출을 기다리지 않고 지운다.
+이후 incremental vacuum 으로 빈 페이지를 파일에서 돌려준다.
+auto_vacuum=INCREMENTAL 전환(전체 VACUUM, 쓰기 락을 오래 잡음)은 배포 때 init-db 가 한 번 하고,
+여기서는 하지 않는다 (전환 전이면 빈 페이지는 파일 안에서 재사용만 된다).
+
+    flask --app main purge-fortunes --days 30 [--archive fortune_archive.db]
+"""
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from llm_cache import TEMPLATES, cache_key
+
+FORTUNE_RETENTION_DAYS = 30
+JOB_RETENTION_HOURS = 24
+
+
+def table_sizes(conn):
+    """테이블·인덱스별 행 수와 바이트 (dbstat 이 없으면 행 수만)"""
+    report = {"file_bytes": conn.execute("PRAGMA page_count").fetchone()[0]
+                            * conn.execute("PRAGMA page_size").fetchone()[0],
+              "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0]
+                            * conn.execute("PRAGMA page_size").fetchone()[0],
+              "tables": {}}
+    for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'").fetchall():
+        report["tables"][name] = {"rows": conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]}
+    try:
+        for name, size in conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"):
+            report["tables"].setdefault(name, {})["bytes"] = size
+    except sqlite3.OperationalError:
+        pass  # SQLITE_ENABLE_DBSTAT_VTAB 없이 빌드된 경우
+    return report
+
+
+def incremental_vacuum_enabled(conn):
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def enable_incremental_vacuum(conn):
+    """
+    auto_vacuum 을 INCREMENTAL 로 (처음 한 번은 전체 VACUUM 이 필요)
+    전체 VACUUM 동안 쓰기가 막히므로 워커를 띄우기 전(init-db)에만 호출한다.
+    """
+    if incremental_vacuum_enabled(conn):
+        return False
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def purge_expired_fortunes(conn, days=FORTUNE_RETENTION_DAYS, batch_size=1000,
+                           archive_path=None, pause=0.0):
+    """
+    date 가 오늘-days 보다 이전인 user_fortunes 행을 삭제 (archive_path 가 있으면 먼저 보관)
+    → 지운 행 수
+    conn 은 isolation_level=None (autocommit) 연결이어야 한다.
+    """
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    if archive_path:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        conn.execute("CREATE TABLE IF NOT EXISTS archive.user_fortunes AS SELECT * FROM main.user_fortunes WHERE 0")
+    purged = 0
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [r[0] for r in conn.execute(
+                    "SELECT id FROM user_fortunes WHERE date < ? LIMIT ?", (cutoff, batch_size))]
+                if ids:
+                    marks = ",".join("?" * len(ids))
+                    if archive_path:
+                        conn.execute(f"INSERT INTO archive.user_fortunes SELECT * FROM main.user_fortunes "
+                                     f"WHERE id IN ({marks})", ids)
+                    conn.execute(f"DELETE FROM user_fortunes WHERE id IN ({marks})", ids)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            purged += len(ids)
+            if len(ids) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)   # 요청 쪽 쓰기에 락을 양보
+    finally:
+        if archive_path:
+            conn.execute("DETACH DATABASE archive")
+    return purged
+
+
+def purge_old_jobs(conn, hours=JOB_RETENTION_HOURS, batch_size=1000, pause=0.0):
+    """
+    created 가 hours 시간보다 오래된 llm_jobs 행 삭제 → 지운 행 수
+    (JOB_TIMEOUT 보다 훨씬 길므로 끝났거나 실행하던 워커가 죽은 작업뿐)
+    conn 은 isolation_level=None (autocommit) 연결이어야 한다.
+    """
+    cutoff = datetime.now() - timedelta(hours=hours)
+    purged = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = conn.execute(
+                "DELETE FROM llm_jobs WHERE id IN (SELECT id FROM llm_jobs WHERE created < ? LIMIT ?)",
+                (cutoff, batch_size)).rowcount
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        purged += deleted
+        if deleted < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return purged
+
+
+def purge_past_buckets(conn, batch_size=1000, pause=0.0, now=None):
+    """
+    날짜 구간 템플릿의 llm_cache 행 중 오늘 이전 날짜나 예전 버전 행 삭제 → 지운 행 수
+    키가 '템플릿:v버전:날짜:...' 라 템플릿 키 범위(기본 키 인덱스) 안에서 오늘 키보다 작은 것을 고른다.
+    conn 은 isolation_level=None (autocommit) 연결이어야 한다.
+    """
+    purged = 0
+    for template, (version, bucket) in TEMPLATES.items():
+        if bucket is None:
+            continue
+        # ';' 는 ':' 다음 문자 → (템플릿:, 템플릿;) 범위가 이 템플릿의 키 전체
+        params = (f"{template}:", f"{template};", version, cache_key(template, "", now), batch_size)
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache WHERE key > ? AND key < ? "
+                    "AND (version <> ? OR key < ?) LIMIT ?)", params).rowcount
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            purged += deleted
+            if deleted < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    return purged
+
+
+def run_retention(db_name, days=FORTUNE_RETENTION_DAYS, batch_size=1000, archive_path=None,
+                  job_hours=JOB_RETENTION_HOURS):
+    """보존 정책 실행 + 전후 크기 보고 → {'purged', 'jobs_purged', 'buckets_purged', 'before', 'after'}"""
+    conn = sqlite3.connect(db_name, isolation_level=None, timeout=30)
+    try:
+        before = table_sizes(conn)
+        incremental = incremental_vacuum_enabled(conn)
+        purged = purge_expired_fortunes(conn, days, batch_size, archive_path, pause=0.01)
+        jobs_purged = purge_old_jobs(conn, job_hours, batch_size, pause=0.01)
+        buckets_purged = purge_past_buckets(conn, batch_size, pause=0.01)
+        if incremental:
+            # execute() 로는 한 단계(한 페이지)만 실행되므로 executescript 로 끝까지 돌린다
+            conn.executescript("PRAGMA incremental_vacuum;")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        after = table_sizes(conn)
+    finally:
+        conn.close()
+    return {"purged": purged, "cutoff_days": days, "jobs_purged": jobs_purged, "job_hours": job_hours,
+            "buckets_purged": buckets_purged,
+            "incremental_vacuum": incremental,
+            "before": before, "after": after}
+
+
+def format_report(result):
+    lines = [f"user_fortunes {result['purged']}행 정리 (보존 {result['cutoff_days']}일)",
+             f"llm_jobs {result['jobs_purged']}행 정리 (보존 {result['job_hours']}시간)",
+             f"llm_cache 지난 날짜 구간 {result['buckets_purged']}행 정리"]
+    if not result["incremental_vacuum"]:
+        lines.append("⚠️ auto_vacuum 이 INCREMENTAL 이 아니라 파일 크기는 줄지 않습니다 "
+                     "(배포 때 'flask --app main init-db' 로 전환)")
+    before, after = result["before"], result["after"]
+    lines.append(f"파일 크기: {before['file_bytes']:,} → {after['file_bytes']:,} bytes "
+                 f"(빈 페이지 {before['free_bytes']:,} → {after['free_bytes']:,})")
+    for name in sorted(set(before["tables"]) | set(after["tables"])):
+        b, a = before["tables"].get(name, {}), after["tables"].get(name, {})
+        row = f"  {name}: "
+        if "rows" in b or "rows" in a:
+            row += f"{b.get('rows', 0):,} → {a.get('rows', 0):,}행"
+        if "bytes" in b or "bytes" in a:
+            row += f" / {b.get('bytes', 0):,} → {a.get('bytes', 0):,} bytes"
+        lines.append(row)
+    return "\n".join(lines)
@@ -0,0 +1,233 @@
+# migrations.py
+"""
+쓰기 DB(fortune.db) 스키마 마이그레이션
+
+PRAGMA user_version 에 적용된 마지막 버전을 기록하고, 그보다 큰 버전만
+순서대로 하나의 트랜잭션씩 적용한다. 스키마를 바꿀 때는 기존 항목을 고치지 말고
+MIGRATIONS 끝에 새 버전을 추가한다.
+
+버전 1 은 IF NOT EXISTS 로 되어 있어 init_db 시절에 만든 DB 도 그대로 이어받는다.
+
+핫 쿼리 실행 계획 확인 (테이블 전체 스캔이면 종료 코드 1, 참조 DB 도 있으면 함께 확인):
+    python migrations.py [DB 경로] --check
+--check 는 읽기 전용으로 열어 확인만 한다 (마이그레이션 적용은 인자 없이 실행하거나 init-db).
+"""
+import sqlite3
+
+MIGRATIONS = [
+    (1, "초기 스키마", """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            email TEXT,
+            birthdate TEXT,
+            birthhour INTEGER,
+            session_token TEXT,
+            first_visit TIMESTAMP,
+            last_visit TIMESTAMP,
+            visit_count INTEGER DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS user_fortunes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT,
+            menu TEXT,
+            date TEXT,
+            result TEXT
+        );
+        CREATE TABLE IF NOT EXISTS match_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT UNIQUE,
+            report TEXT,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+    (2, "accounts 테이블 (login/signup 요청마다 만들던 것)", """
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE,
+            password TEXT
+        );
+    """),
+    (3, "핫 쿼리 인덱스", """
+        -- get_fortune_from_db: email, menu, date 동등 조건
+        CREATE INDEX IF NOT EXISTS idx_user_fortunes_lookup ON user_fortunes (email, menu, date);
+        -- save_or_update_user: email, session_token 동등 조건 (id 는 rowid 라 인덱스에 포함됨)
+        CREATE INDEX IF NOT EXISTS idx_users_email_token ON users (email, session_token);
+    """),
+    (4, "보존 기간 정리용 인덱스", """
+        -- maintenance.purge_expired_fortunes: date < ? 범위 조건
+        CREATE INDEX IF NOT EXISTS idx_user_fortunes_date ON user_fortunes (date);
+    """),
+    (5, "LLM 백그라운드 작업 (jobs.py)", """
+        CREATE TABLE IF NOT EXISTS llm_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            owner TEXT,
+            status TEXT NOT NULL,       -- pending | running | done | error
+            result TEXT,
+            error TEXT,
+            created TIMESTAMP,
+            started TIMESTAMP,
+            finished TIMESTAMP
+        );
+    """),
+    (6, "LLM 응답 공용 캐시 (llm_cache.py), 기존 궁합 리포트 이전", """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,       -- 템플릿:v버전:날짜구간:명식코드
+            template TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            result TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            created TIMESTAMP,
+            last_used TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used);
+        -- match_reports 의 '<종류>:<명식쌍>' 키는 이미 명식 기반이므로 그대로 옮긴다
+        INSERT OR IGNORE INTO llm_cache (key, template, version, result, bytes, created, last_used)
+        SELECT 'match_' || substr(key, 1, instr(key, ':') - 1) || ':v1:-:' || substr(key, instr(key, ':') + 1),
+               'match_' || substr(key, 1, instr(key, ':') - 1), 1, report, length(CAST(report AS BLOB)),
+               created, created
+        FROM match_reports
+        WHERE (key LIKE 'preview:%' OR key LIKE 'report:%') AND report IS NOT NULL;
+    """),
+    (7, "LLM 생성 임대 (llm_cache.py single-flight, 워커 간)", """
+        CREATE TABLE IF NOT EXISTS llm_leases (
+            key TEXT PRIMARY KEY,       -- llm_cache.key 와 같음
+            owner TEXT NOT NULL,        -- pid:uuid
+            expires REAL NOT NULL       -- time.time() 기준, 지나면 다른 워커가 가져갈 수 있음
+        );
+    """),
+    (8, "LLM 작업 보존 기간 정리용 인덱스", """
+        -- maintenance.purge_old_jobs: created < ? 범위 조건
+        CREATE INDEX IF NOT EXISTS idx_llm_jobs_created ON llm_jobs (created);
+    """),
+    (9, "방문자·하루치 운세를 UNIQUE 인덱스로 (upsert 대상)", """
+        -- 같은 방문자(email, session_token) 중복 행은 가장 작은 id 로 합친다
+        UPDATE users SET
+            visit_count = (SELECT SUM(COALESCE(u.visit_count, 1)) FROM users u
+                           WHERE u.email = users.email AND u.session_token = users.session_token),
+            first_visit = (SELECT MIN(u.first_visit) FROM users u
+                           WHERE u.email = users.email AND u.session_token = users.session_token),
+            last_visit = (SELECT MAX(u.last_visit) FROM users u
+                          WHERE u.email = users.email AND u.session_token = users.session_token)
+        WHERE id IN (SELECT MIN(id) FROM users GROUP BY email, session_token HAVING COUNT(*) > 1)
+            AND email IS NOT NULL AND session_token IS NOT NULL;
+        DELETE FROM users WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY email, session_token)
+            AND email IS NOT NULL AND session_token IS NOT NULL;
+        DROP INDEX IF EXISTS idx_users_email_token;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_visitor ON users (email, session_token);
+        -- 같은 날 같은 메뉴는 마지막 행만 남긴다
+        DELETE FROM user_fortunes WHERE id NOT IN (SELECT MAX(id) FROM user_fortunes GROUP BY email, menu, date)
+            AND email IS NOT NULL AND menu IS NOT NULL AND date IS NOT NULL;
+        -- result 는 운세 전문이라 인덱스에 넣지 않는다 (covering 이면 본문이 두 벌 저장됨,
+        -- 조회는 하루 한 행이라 rowid 로 한 번 더 읽는 비용이 작다)
+        DROP INDEX IF EXISTS idx_user_fortunes_lookup;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_fortunes_day ON user_fortunes (email, menu, date);
+    """),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# (이름, SQL, 파라미터) — 요청 경로에서 실행되는 조회
+HOT_QUERIES = [
+    ("match_top_caller",
+     "SELECT id FROM users WHERE email = ? AND session_token = ?", ("", "")),
+    ("llm_cache",
+     "SELECT result, last_used FROM llm_cache WHERE key = ?", ("",)),
+    ("login",
+     "SELECT email FROM accounts WHERE email=? AND password=?", ("", "")),
+    ("llm_job_status",
+     "SELECT id, kind, owner, status, result, error, created, finished FROM llm_jobs WHERE id = ?", ("",)),
+    ("purge_expired_fortunes",
+     "SELECT id FROM user_fortunes WHERE date < ? LIMIT ?", ("", 1)),
+    ("purge_old_jobs",
+     "SELECT id FROM llm_jobs WHERE created < ? LIMIT ?", ("", 1)),
+    ("purge_past_buckets",
+     "SELECT key FROM llm_cache WHERE key > ? AND key < ? AND (version <> ? OR key < ?) LIMIT ?",
+     ("", "", 0, "", 1)),
+]
+
+# 참조 DB(reference.db, reference_data.build_reference_db 가 인덱스까지 생성)
+REFERENCE_HOT_QUERIES = [
+    ("saju_interpretations",
+     "SELECT cn, kr, en FROM saju_interpretations WHERE ilju = ?", ("",)),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """적용되지 않은 마이그레이션을 순서대로 적용하고 적용한 버전 목록 반환"""
+    current = schema_version(conn)
+    applied = []
+    for version, _description, sql in MIGRATIONS:
+        if version <= current:
+            continue
+        # executescript 는 자체적으로 COMMIT 하므로 BEGIN/COMMIT 을 스크립트에 넣는다
+        try:
+            conn.executescript(f"BEGIN IMMEDIATE;\n{sql}\nPRAGMA user_version = {version};\nCOMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def table_scans(conn, queries=HOT_QUERIES):
+    """
+    인덱스를 타지 않고 테이블 전체를 스캔하는 핫 쿼리 → [(이름, 계획 상세), ...]
+    비어 있으면 모두 인덱스 검색(SEARCH)이다.
+    """
+    scans = []
+    for name, sql, params in queries:
+        for _id, _parent, _notused, detail in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+            if detail.startswith("SCAN"):
+                scans.append((name, detail))
+    return scans
+
+
+if __name__ == "__main__":
+    import sys
+
+    import os
+
+    from db import DB_NAME, REFERENCE_DB_NAME, connect_readonly, connect_reference
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    path = args[0] if args else DB_NAME
+    if "--check" not in sys.argv:
+        conn = sqlite3.connect(path)
+        try:
+            applied = migrate(conn)
+            print(f"스키마 버전 {schema_version(conn)} (이번에 적용: {applied or '없음'})")
+        finally:
+            conn.close()
+    else:
+        # 확인만 (DB 를 바꾸지 않음)
+        conn = connect_readonly(path, mmap_size=0)
+        try:
+            version = schema_version(conn)
+            print(f"스키마 버전 {version}")
+            if version < SCHEMA_VERSION:
+                print(f"❌ 적용되지 않은 마이그레이션이 있습니다 ({version} < {SCHEMA_VERSION}): "
+                      f"'flask --app main init-db' 를 먼저 실행하세요")
+                sys.exit(1)
+            scans = table_scans(conn)
+        finally:
+            conn.close()
+        checked = len(HOT_QUERIES)
+        if os.path.exists(REFERENCE_DB_NAME):
+            ref = connect_reference(REFERENCE_DB_NAME)
+            try:
+                scans += table_scans(ref, REFERENCE_HOT_QUERIES)
+            finally:
+                ref.close()
+            checked += len(REFERENCE_HOT_QUERIES)
+        for name, detail in scans:
+            print(f"❌ {name}: {detail}")
+        if scans:
+            sys.exit(1)
+        print(f"✅ 핫 쿼리 {checked}개 모두 인덱스 사용")
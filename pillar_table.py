@@ -0,0 +1,215 @@
+# pillar_table.py
+"""
+사주 기둥 사전 계산 테이블
+
+1900-01-01 ~ 2100-12-31 의 날짜별 연주·월주·일주를 60갑자 코드(0~59)
+3바이트로 저장해 두고, 워커마다 한 번 mmap 으로 열어 조회한다.
+(mmap 은 페이지 캐시를 공유하므로 gunicorn 워커가 같은 메모리를 본다)
+시주는 일간과 시각만으로 정해지므로 테이블 없이 계산한다.
+테이블 범위 밖의 날짜나 테이블 파일이 없을 때는 sxtwl 로 계산한다.
+
+빌드: python pillar_table.py [출력 경로]
+"""
+import mmap
+import os
+import struct
+from datetime import date, timedelta
+
+import sxtwl
+
+GAN = "甲乙丙丁戊己庚辛壬癸"   # 天干 0~9
+ZHI = "子丑寅卯辰巳午未申酉戌亥" # 地支 0~11
+
+# 60갑자 코드 → 간지 문자열 (0: 甲子, 1: 乙丑, ... 59: 癸亥)
+GANZHI = [GAN[i % 10] + ZHI[i % 12] for i in range(60)]
+GANZHI_CODE = {gz: i for i, gz in enumerate(GANZHI)}
+
+TABLE_PATH = os.getenv("PILLAR_TABLE_PATH", "pillar_table.bin")
+TABLE_MAGIC = b"SZPT"
+TABLE_VERSION = 1
+# magic, version, record size, 시작 날짜(ordinal), 날짜 수
+TABLE_HEADER = struct.Struct("<4sHHII")
+RECORD_SIZE = 3  # 연주, 월주, 일주 코드
+
+START_DATE = date(1900, 1, 1)
+END_DATE = date(2100, 12, 31)
+
+# numpy datetime64[D] 의 0일(1970-01-01) ordinal, 일주 코드 = (ordinal + 14) % 60
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_DAY_CODE_OFFSET = 14
+
+
+def gz_code(tg, dz):
+    """천간(0~9)·지지(0~11) 인덱스 → 60갑자 코드"""
+    return (6 * tg - 5 * dz) % 60
+
+
+def hour_code(day_code, hour):
+    """
+    일주 코드와 시(0~23)로 시주 코드 계산 (sxtwl getHourGZ 와 동일 규칙)
+    23시는 다음 날 자시로 보아 천간이 이어진다.
+    """
+    step = (hour + 1) // 2
+    return gz_code((day_code % 10 % 5 * 2 + step) % 10, step % 12)
+
+
+def _sxtwl_codes(year, month, day):
+    d = sxtwl.fromSolar(year, month, day)
+    y_gz = d.getYearGZ(False)
+    m_gz = d.getMonthGZ()
+    d_gz = d.getDayGZ()
+    return (gz_code(y_gz.tg, y_gz.dz),
+            gz_code(m_gz.tg, m_gz.dz),
+            gz_code(d_gz.tg, d_gz.dz))
+
+
+class PillarTable:
+    """mmap 으로 연 읽기 전용 기둥 테이블"""
+    __slots__ = ("path", "start_ordinal", "count", "_mm")
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, start, count = TABLE_HEADER.unpack_from(self._mm, 0)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION or record_size != RECORD_SIZE:
+            self._mm.close()
+            raise ValueError(f"잘못된 기둥 테이블 파일: {path}")
+        if len(self._mm) < TABLE_HEADER.size + count * RECORD_SIZE:
+            self._mm.close()
+            raise ValueError(f"기둥 테이블 파일이 잘렸습니다: {path}")
+        self.path = path
+        self.start_ordinal = start
+        self.count = count
+
+    def codes(self, ordinal):
+        """날짜 ordinal → (연주, 월주, 일주) 코드, 범위 밖이면 None"""
+        idx = ordinal - self.start_ordinal
+        if 0 <= idx < self.count:
+            off = TABLE_HEADER.size + idx * RECORD_SIZE
+            return tuple(self._mm[off:off + RECORD_SIZE])
+        return None
+
+    def buffer(self):
+        """레코드 영역 전체 (배치 계산용, 복사 없음)"""
+        return memoryview(self._mm)[TABLE_HEADER.size:TABLE_HEADER.size + self.count * RECORD_SIZE]
+
+
+def load_table(path=TABLE_PATH):
+    """테이블 파일을 열어 반환, 없거나 손상됐으면 None (sxtwl 로 대체)"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return PillarTable(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"⚠️ 기둥 테이블 로드 실패, sxtwl 사용: {e}")
+        return None
+
+
+# 워커당 한 번만 연다
+_table = load_table()
+
+
+def get_table():
+    return _table
+
+
+def pillar_codes(year, month, day, hour):
+    """양력 날짜·시 → (연주, 월주, 일주, 시주) 60갑자 코드"""
+    codes = None
+    if _table is not None:
+        codes = _table.codes(date(year, month, day).toordinal())
+    if codes is None:
+        codes = _sxtwl_codes(year, month, day)
+    return codes + (hour_code(codes[2], hour),)
+
+
+def pillars_to_dict(codes):
+    year, month, day, hour = codes
+    return {
+        "year": GANZHI[year],
+        "month": GANZHI[month],
+        "day": GANZHI[day],
+        "hour": GANZHI[hour],
+    }
+
+
+def batch_pillar_codes(gmt_datetimes, tz_offset_hours=9):
+    """
+    여러 명의 사주를 한 번에 계산 (four_pillars_from_gmt 의 배치 버전)
+    gmt_datetimes : UTC 기준 datetime 들 (numpy datetime64 배열 또는 iterable)
+    tz_offset_hours : 시차(시간), 스칼라 또는 같은 길이의 배열
+    반환: {"year", "month", "day", "hour"} → 60갑자 코드 uint8 배열
+
+    일주·시주는 날짜 번호의 나머지 연산으로, 연주·월주는 테이블에서
+    한 번에 읽는다. 테이블 범위 밖 날짜만 날짜별로 sxtwl 을 호출한다.
+    """
+    import numpy as np
+
+    dts = np.asarray(gmt_datetimes, dtype="datetime64[m]")
+    offsets = np.rint(np.asarray(tz_offset_hours, dtype=np.float64) * 60)
+    local = dts + offsets.astype(np.int64).astype("timedelta64[m]")
+    local_days = local.astype("datetime64[D]")
+    hours = (local - local_days).astype(np.int64) // 60
+    ordinals = local_days.astype(np.int64) + _EPOCH_ORDINAL
+
+    day = (ordinals + _DAY_CODE_OFFSET) % 60
+    step = (hours + 1) // 2
+    hour = (6 * ((day % 10 % 5 * 2 + step) % 10) - 5 * (step % 12)) % 60
+
+    year = np.zeros(day.shape, dtype=np.uint8)
+    month = np.zeros(day.shape, dtype=np.uint8)
+    if _table is not None:
+        idx = ordinals - _table.start_ordinal
+        in_range = (idx >= 0) & (idx < _table.count)
+        records = np.frombuffer(_table.buffer(), dtype=np.uint8).reshape(-1, RECORD_SIZE)
+        year[in_range] = records[idx[in_range], 0]
+        month[in_range] = records[idx[in_range], 1]
+    else:
+        in_range = np.zeros(day.shape, dtype=bool)
+
+    # 범위 밖 날짜는 고유 날짜별로 한 번씩만 sxtwl 계산
+    missing = ~in_range
+    if missing.any():
+        uniq, inverse = np.unique(ordinals[missing], return_inverse=True)
+        fallback = np.array([_sxtwl_codes(*date.fromordinal(int(o)).timetuple()[:3])[:2]
+                             for o in uniq], dtype=np.uint8).reshape(-1, 2)
+        year[missing] = fallback[inverse, 0]
+        month[missing] = fallback[inverse, 1]
+
+    return {
+        "year": year,
+        "month": month,
+        "day": day.astype(np.uint8),
+        "hour": hour.astype(np.uint8),
+    }
+
+
+def build_table(path=TABLE_PATH, start=START_DATE, end=END_DATE):
+    """sxtwl 로 전체 기간을 계산해 테이블 파일 생성 (시주 규칙도 함께 검증)"""
+    count = (end - start).days + 1
+    buf = bytearray(TABLE_HEADER.size + count * RECORD_SIZE)
+    TABLE_HEADER.pack_into(buf, 0, TABLE_MAGIC, TABLE_VERSION, RECORD_SIZE,
+                           start.toordinal(), count)
+    for i in range(count):
+        d = start + timedelta(days=i)
+        codes = _sxtwl_codes(d.year, d.month, d.day)
+        day_obj = sxtwl.fromSolar(d.year, d.month, d.day)
+        for h in range(0, 24):
+            h_gz = day_obj.getHourGZ(h)
+            if gz_code(h_gz.tg, h_gz.dz) != hour_code(codes[2], h):
+                raise RuntimeError(f"시주 규칙 불일치: {d} {h}시")
+        off = TABLE_HEADER.size + i * RECORD_SIZE
+        buf[off:off + RECORD_SIZE] = bytes(codes)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buf)
+    os.replace(tmp_path, path)
+    return count
+
+
+if __name__ == "__main__":
+    import sys
+    out = sys.argv[1] if len(sys.argv) > 1 else TABLE_PATH
+    n = build_table(out)
+    print(f"기둥 테이블 저장 완료: {out} ({n}일)")
@@ -0,0 +1,293 @@
+# reference_data.py
+"""
+읽기 전용 참조 데이터 (일주 해석 60건 + 三命通会 구절)
+
+일주 해석은 ilju_db.csv 로 만든 reference.db (배포 산출물), 구절은 ctext.db 에서 읽는다.
+둘 다 읽기 전용 연결로 열며 사용자 쓰기 DB(fortune.db)와는 분리되어 있다.
+
+실행 중에는 바뀌지 않는 데이터이므로 한 번 읽어 불변 구조로 들고 있는다.
+gunicorn preload_app 모드에서는 마스터가 fork 전에 읽으므로
+워커들이 copy-on-write 로 같은 메모리를 공유한다 (gunicorn.conf.py 참고).
+줄바꿈 → <br> 변환, 구절 결합 같은 표시용 가공도 읽을 때 한 번만 한다.
+요청 처리 중에는 SQLite 를 열지 않는다.
+
+se_translate.py 가 번역을 채우거나 ilju_db.csv 를 다시 넣으면
+파일 mtime/크기가 바뀌므로, RELOAD_INTERVAL 초마다 stat 으로 확인해
+새 스냅샷을 읽고 내용 해시(version)가 다를 때만 통째로 교체한다.
+교체는 참조 하나를 바꾸는 것이므로 이미 스냅샷을 잡은 요청은 끝까지 그 스냅샷을 쓴다.
+"""
+import csv
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from types import MappingProxyType
+
+from ctext_index import CTEXT_DB_NAME, load_pillar_passages
+from db import REFERENCE_DB_NAME, connect_readonly, connect_reference
+
+ILJU_CSV_PATH = "ilju_db.csv"
+
+EMPTY_ILJU = MappingProxyType({"cn": None, "kr": None, "en": None})
+
+
+class CtextEntry:
+    """(일주, 시주) 하나에 해당하는 구절 묶음"""
+    __slots__ = ("rows", "explanation", "kr_literal")
+
+    def __init__(self, rows):
+        self.rows = tuple(rows)                       # ((content, kr_literal), ...)
+        self.explanation = "\n\n".join(c for c, _ in self.rows)
+        self.kr_literal = "\n\n".join(k for _, k in self.rows if k)
+
+
+class ReferenceData:
+    __slots__ = ("ilju", "ctext", "version", "fingerprint", "loaded_at")
+
+    def __init__(self, ilju, ctext, fingerprint=None):
+        self.ilju = MappingProxyType(ilju)     # 일주 → {'cn', 'kr', 'en'} (<br> 변환 완료)
+        self.ctext = MappingProxyType(ctext)   # (일주, 시주) → CtextEntry
+        self.version = _content_hash(ilju, ctext)
+        self.fingerprint = fingerprint
+        self.loaded_at = time.time()
+
+
+def _content_hash(ilju, ctext):
+    h = hashlib.sha256()
+    for key in sorted(ilju):
+        row = ilju[key]
+        h.update(repr((key, row["cn"], row["kr"], row["en"])).encode("utf-8"))
+    for key in sorted(ctext):
+        h.update(repr((key, ctext[key].rows)).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _fingerprint(*paths):
+    """DB 파일(+WAL)의 (mtime, 크기) — 내용이 바뀌었을 수 있는지 싸게 확인"""
+    fp = []
+    for path in paths:
+        for p in (path, path + "-wal"):
+            try:
+                st = os.stat(p)
+            except OSError:
+                fp.append((p, None))
+            else:
+                fp.append((p, st.st_mtime_ns, st.st_size))
+    return tuple(fp)
+
+
+def _br(text):
+    return text.replace('\n', '<br>') if text else None
+
+
+def load_ilju(conn):
+    ilju = {}
+    for key, cn, kr, en in conn.execute(
+            "SELECT ilju, cn, kr, en FROM saju_interpretations ORDER BY id"):
+        # 같은 일주가 여러 행이면 먼저 들어간 행을 쓴다 (기존 fetchone 동작)
+        if key not in ilju:
+            ilju[key] = MappingProxyType({"cn": _br(cn), "kr": _br(kr), "en": _br(en)})
+    return ilju
+
+
+def load_ctext(conn):
+    # 구절 색인은 init-db 가 만든다 (그 전의 ctext.db 로도 워커·init-db 가 뜰 수 있게 빈 값으로)
+    has_index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='wiki_pillar_index'").fetchone()
+    if not has_index:
+        print("⚠️ ctext.db 에 구절 색인(wiki_pillar_index)이 없습니다: 'flask --app main init-db' 를 먼저 실행하세요")
+        return {}
+    ctext = {}
+    for key, rows in load_pillar_passages(conn).items():
+        rows = [(content, kr_literal) for _id, content, kr_literal in rows if content]
+        if rows:
+            ctext[key] = CtextEntry(rows)
+    return ctext
+
+
+def csv_checksum(csv_path):
+    with open(csv_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def reference_checksum(path=REFERENCE_DB_NAME):
+    """참조 DB 를 만들 때 쓴 CSV 의 sha256 (없거나 읽을 수 없으면 None)"""
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = connect_reference(path)
+        try:
+            row = conn.execute("SELECT value FROM reference_meta WHERE key = 'ilju_csv_sha256'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def read_ilju_csv(csv_path):
+    """ilju_db.csv → [(type, ilju, cn, kr, en), ...]"""
+    rows = []
+    with open(csv_path, newline='', encoding='utf-8') as csvfile:
+        for row in csv.reader(csvfile):
+            if len(row) < 5:
+                continue  # 잘못된 행은 건너뜀
+            row = [item.strip() for item in row]
+            if row[0].startswith('\ufeff'):
+                row[0] = row[0].replace('\ufeff', '')
+            type_str, ilju, cn, kr, en = row
+            rows.append((int(type_str), ilju, cn, kr, en))
+    return rows
+
+
+def build_reference_db(path=REFERENCE_DB_NAME, csv_path=ILJU_CSV_PATH, force=False):
+    """
+    CSV 로 참조 DB 를 새로 만들어 원자적으로 교체 (읽는 워커는 다음 확인 때 새 파일을 읽음)
+    CSV 체크섬이 기존 파일에 기록된 것과 같으면 건너뛰고 None 반환
+    """
+    checksum = csv_checksum(csv_path)
+    if not force and reference_checksum(path) == checksum:
+        return None
+    rows = read_ilju_csv(csv_path)
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("""
+            CREATE TABLE saju_interpretations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type INTEGER,
+                ilju TEXT,
+                cn TEXT,
+                kr TEXT,
+                en TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX idx_saju_interpretations_ilju ON saju_interpretations (ilju)")
+        conn.executemany("INSERT INTO saju_interpretations (type, ilju, cn, kr, en) VALUES (?, ?, ?, ?, ?)",
+                         rows)
+        conn.execute("CREATE TABLE reference_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany("INSERT INTO reference_meta (key, value) VALUES (?, ?)",
+                         [("ilju_csv_sha256", checksum),
+                          ("built", datetime.now().isoformat(timespec="seconds"))])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+def load_reference_data(reference_db_name=REFERENCE_DB_NAME, ctext_db_name=CTEXT_DB_NAME):
+    # 읽기 전에 찍어 두어야 읽는 도중 바뀐 경우 다음 확인에서 다시 읽는다
+    fingerprint = _fingerprint(reference_db_name, ctext_db_name)
+    ilju = {}
+    if os.path.exists(reference_db_name):
+        conn = connect_reference(reference_db_name)
+        try:
+            ilju = load_ilju(conn)
+        finally:
+            conn.close()
+    ctext = {}
+    if os.path.exists(ctext_db_name):
+        conn = connect_readonly(ctext_db_name)
+        try:
+            ctext = load_ctext(conn)
+        finally:
+            conn.close()
+    return ReferenceData(ilju, ctext, fingerprint)
+
+
+RELOAD_INTERVAL = float(os.getenv("REFERENCE_RELOAD_INTERVAL", "30"))  # 0 이하면 자동 확인 안 함
+
+_current = None
+_source = None                   # (reference_db_name, ctext_db_name)
+_reload_lock = threading.Lock()
+_next_check = 0.0
+_reloads = 0
+
+
+def preload_reference_data(reference_db_name=REFERENCE_DB_NAME, ctext_db_name=CTEXT_DB_NAME):
+    """앱 import 시점(fork 전)에 호출"""
+    global _current, _source, _next_check
+    with _reload_lock:
+        _source = (reference_db_name, ctext_db_name)
+        _current = load_reference_data(reference_db_name, ctext_db_name)
+        _next_check = time.monotonic() + RELOAD_INTERVAL
+    return _current
+
+
+def reload_reference_data(force=False):
+    """
+    원본 파일이 바뀌었으면 다시 읽어 교체 (교체했으면 True)
+    force=True 면 파일 상태와 관계없이 다시 읽는다. 내용 해시가 같으면 교체하지 않는다.
+    """
+    with _reload_lock:
+        return _reload(force)
+
+
+def _reload(force):
+    # _reload_lock 을 잡은 상태에서 호출
+    global _current, _next_check, _reloads
+    _next_check = time.monotonic() + RELOAD_INTERVAL
+    current = _current
+    if _source is None:
+        return False
+    if not force and current is not None and current.fingerprint == _fingerprint(*_source):
+        return False
+    try:
+        fresh = load_reference_data(*_source)
+    except sqlite3.Error as e:
+        # 쓰는 중이라 잠겨 있거나 하면 기존 스냅샷 유지, 다음 주기에 재시도
+        print(f"⚠️ 참조 데이터 다시 읽기 실패, 기존 스냅샷 유지: {e}")
+        return False
+    if current is not None and fresh.version == current.version:
+        current.fingerprint = fresh.fingerprint
+        return False
+    _current = fresh
+    _reloads += 1
+    return True
+
+
+def get_reference_data():
+    """
+    현재 참조 데이터 스냅샷
+    요청 하나 안에서는 한 번 받아 둔 스냅샷을 계속 써야 중간 교체에 영향받지 않는다.
+    """
+    if RELOAD_INTERVAL > 0 and time.monotonic() >= _next_check and _reload_lock.acquire(blocking=False):
+        # 확인은 한 스레드만, 나머지는 기다리지 않고 기존 스냅샷 사용
+        try:
+            if time.monotonic() >= _next_check:
+                _reload(False)
+        finally:
+            _reload_lock.release()
+    data = _current
+    if data is None:
+        raise RuntimeError("참조 데이터가 로드되지 않았습니다 (preload_reference_data 필요)")
+    return data
+
+
+def reference_data_stats():
+    data = _current
+    return {
+        "version": data.version if data else None,
+        "loaded_at": datetime.fromtimestamp(data.loaded_at).isoformat(timespec="seconds") if data else None,
+        "ilju": len(data.ilju) if data else 0,
+        "ctext": len(data.ctext) if data else 0,
+        "reloads": _reloads,
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    src = args[0] if args else ILJU_CSV_PATH
+    out = args[1] if len(args) > 1 else REFERENCE_DB_NAME
+    n = build_reference_db(out, src, force="--force" in sys.argv)
+    if n is None:
+        print(f"CSV 가 바뀌지 않아 건너뜀: {out}")
+    else:
+        print(f"참조 DB 저장 완료: {out} ({n}건)")
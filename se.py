@@ -3,6 +3,7 @@ from selenium.webdriver.chrome.options import Options
 from bs4 import BeautifulSoup
 import sqlite3
 import time
+from ctext_index import ensure_fts, ensure_pillar_index, index_passage
 
 # 브라우저 설정
 options = Options()
@@ -36,6 +37,10 @@ CREATE TABLE IF NOT EXISTS wiki_content (
     kr_explained TEXT
 )
 """)
+# 전문 검색 색인 (트리거로 아래 INSERT 가 자동 색인됨)
+ensure_fts(conn)
+# 일주·시주 → 구절 색인 (행마다 아래에서 index_passage 로 추가)
+ensure_pillar_index(conn)
 
 for soup in all_html:
     all_rows = soup.select("tr.result")
@@ -56,6 +61,7 @@ for soup in all_html:
                 line_number += 1
                 cur.execute("INSERT INTO wiki_content (section, line_number, content, kr_literal, kr_explained) VALUES (?, ?, ?, NULL, NULL)",
                             (section_title, line_number, content))
+                index_passage(conn, cur.lastrowid, content)
 
 conn.commit()
 conn.close()
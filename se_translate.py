@@ -3,12 +3,15 @@ import sqlite3
 import openai
 import time
 from dotenv import load_dotenv
+from ctext_index import ensure_fts
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # DB 연결
 conn = sqlite3.connect("ctext.db")
 cur = conn.cursor()
+# 전문 검색 색인 (트리거로 아래 UPDATE 가 자동 재색인됨)
+ensure_fts(conn)
 
 # 아직 번역되지 않은 행만 가져옴
 cur.execute("SELECT id, content FROM wiki_content WHERE kr_literal IS NULL OR kr_explained IS NULL")
@@ -0,0 +1,152 @@
+# write_behind.py
+"""
+요청 경로 밖에서 모아 쓰는 write-behind 큐
+
+요청 스레드는 이벤트를 큐에 넣고 바로 돌아가며, 백그라운드 스레드가
+batch_size 개 또는 interval 초 단위로 모아 flush_fn(이벤트 목록)을 한 트랜잭션으로 실행한다.
+
+- 큐가 가득 차면 요청 스레드에서 직접 기록한다 (유실 대신 배압).
+- 기록 실패는 max_retries 번 다시 시도한 뒤 버리고 dropped 로 센다.
+- 스레드는 첫 put 때 시작한다 (gunicorn preload 시 마스터가 아닌 워커에서 뜨도록).
+- 프로세스 종료 시(atexit) 남은 이벤트를 모두 기록한다.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    def __init__(self, name, flush_fn, maxsize=10000, batch_size=500, interval=0.5, max_retries=3):
+        self.name = name
+        self._flush_fn = flush_fn
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.sync_writes = 0     # 큐가 가득 차 요청 스레드에서 직접 기록한 이벤트 수
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # fork 전에 쌓인 이벤트는 부모가 기록한다
+                self._queue = queue.Queue(self.maxsize)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.name}", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def put(self, event):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._stats_lock:
+                self.sync_writes += 1
+            self._write([event])
+            return
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self.enqueued += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def _run(self):
+        q = self._queue
+        stopping = False
+        while not stopping:
+            first = q.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            self._write(batch)
+        # 종료: 큐에 남은 것까지 기록
+        rest = []
+        while True:
+            try:
+                event = q.get_nowait()
+            except queue.Empty:
+                break
+            if event is not _STOP:
+                rest.append(event)
+        for i in range(0, len(rest), self.batch_size):
+            self._write(rest[i:i + self.batch_size])
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        for attempt in range(self.max_retries):
+            try:
+                self._flush_fn(batch)
+                break
+            except Exception as e:
+                with self._stats_lock:
+                    self.errors += 1
+                print(f"⚠️ {self.name} 기록 실패 ({attempt + 1}/{self.max_retries}): {e}")
+                time.sleep(self.interval)
+        else:
+            with self._stats_lock:
+                self.dropped += len(batch)
+            return
+        with self._stats_lock:
+            self.written += len(batch)
+            self.batches += 1
+            self.last_batch_size = len(batch)
+            self.last_flush_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def close(self, timeout=10):
+        """남은 이벤트를 모두 기록하고 스레드 종료"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_depth": self.max_depth,
+                "maxsize": self.maxsize,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "sync_writes": self.sync_writes,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "last_batch_size": self.last_batch_size,
+                "last_flush_ms": self.last_flush_ms,
+            }